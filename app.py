@@ -1,57 +1,637 @@
-import sqlite3
+import functools
+import os
+import threading
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
 import pandas as pd
 import streamlit as st
 
+import compact
+import db
+import perf
+import schema
+import shards
+from downsample import METHODS as DOWNSAMPLE_METHODS, downsample
+
 # ---------- 基本設定 ----------
 st.set_page_config(
     page_title="資料中心監控儀表板（第10週）",
     layout="wide",
 )
 
-DB_PATH = "log.db"
-TABLE_NAME = "logs"
+DB_PATH = db.DB_PATH
+LOCAL_TZ = datetime.now().astimezone().tzinfo
+
+# 側邊欄的時間範圍選項（None 表示不是固定長度）
+TIME_WINDOWS = {
+    "最近 15 分鐘": timedelta(minutes=15),
+    "最近 1 小時": timedelta(hours=1),
+    "最近 24 小時": timedelta(hours=24),
+    "最近 7 天": timedelta(days=7),
+    "自訂": None,
+    "全部": None,
+}
+
+RECENT_ROWS = 50
+LATEST_ROWS = 2  # 指標用最新一筆，前一筆拿來算變化量
+REFRESH_SECONDS = 2  # 背景執行緒多久檢查一次 collector 有沒有寫入新資料
+LIVE_INTERVALS = [1, 2, 5, 10, 30]  # 即時模式可選的更新間隔（秒）
+SHARED_ENTRIES = 16  # 每個共用查詢最多保留幾組結果（舊 version 的會先被擠掉）
+MAX_MS = 2 ** 62  # 沒有結束時間時的上限
+# 診斷模式：記下每個查詢，效能頁用 EXPLAIN QUERY PLAN 檢查有沒有整張表掃描
+QUERY_PLAN_CHECK = os.environ.get("QUERY_PLAN_CHECK") == "1"
+# 圖表 / 指標上顯示的名稱
+LABELS = {"cpu": "CPU", "memory": "Memory", "disk": "Disk"}
+
+
+# ---------- 資料庫結構 ----------
+@st.cache_resource
+def ensure_schema():
+    """第一次執行時把 log.db 升到目前的結構版本（舊的 logs 表也會搬過來）"""
+    conn = db.connect(DB_PATH)
+    try:
+        schema.migrate(conn)
+    finally:
+        conn.close()
 
 
-# ---------- 小工具：找時間欄位 ----------
-def find_time_column(df: pd.DataFrame):
-    """嘗試從欄位名稱裡找出時間欄位（Timestamp / timestamp / time...）"""
-    for col in df.columns:
-        if "time" in col.lower():   # 只要欄位名裡有 time
-            return col
-    return None
+@st.cache_resource
+def read_pool():
+    """唯讀連線池，所有 session 和 rerun 共用（遷移另外開一條讀寫連線）"""
+    return db.ReadPool(DB_PATH, trace=db.record_query if QUERY_PLAN_CHECK else None)
+
+
+def to_local_time(ms: pd.Series) -> pd.Series:
+    """epoch 毫秒（整數）直接轉成本地時間，不經過任何字串解析"""
+    return pd.to_datetime(ms, unit="ms", utc=True).dt.tz_convert(LOCAL_TZ)
+
+
+def to_local_index(ms: np.ndarray) -> pd.DatetimeIndex:
+    """epoch 毫秒陣列直接看成 datetime64[ms]（不複製）再標上時區"""
+    return pd.DatetimeIndex(ms.view("datetime64[ms]")).tz_localize("UTC").tz_convert(LOCAL_TZ)
+
+
+def query_frame(conn, sql: str, params=(), bounds=None, limit=None):
+    """pd.read_sql_query；開了分片（LOG_SHARD_DIR）時只查跟 bounds 重疊的那幾天"""
+    if not shards.enabled():
+        return pd.read_sql_query(sql, conn, params=params)
+    columns, rows = shards.read(conn, sql, params, bounds, limit)
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+
+def read_frame(sql: str, params=(), bounds=None, limit=None):
+    """跑一個查詢並把 timestamp 轉成時間型別（bounds / limit 見 query_frame）"""
+    with read_pool().connection() as conn:
+        with perf.span("query"):
+            df = query_frame(conn, sql, params, bounds, limit)
+    with perf.span("to_datetime"):
+        df["timestamp"] = to_local_time(df["timestamp"])
+    return df
+
+
+# ---------- 資料讀取（Parquet 快照 / 增量）----------
+def read_history(bounds=None, ping_status=None, cpu_min=None, host=None, limit=None):
+    """從 Parquet 快照讀歷史資料，回傳 (DataFrame 或 None, 快照涵蓋到的時間點 或 None)
+
+    只讀 schema 裡的欄位，時間範圍與過濾條件交給 pyarrow 做分區 / row group 剪枝。
+    limit 有值時只要最新的 limit 筆：從最新的一天往回一個分區一個分區讀，湊滿就停。
+    """
+    if not compact.available():
+        return None, None
+    boundary = compact.history_boundary()
+    if boundary is None or (bounds is not None and bounds[0] >= boundary):
+        return None, boundary
+
+    filters = []
+    if bounds is not None:
+        filters += [
+            ("date", ">=", schema.day_name(bounds[0] // schema.DAY_MS)),
+            ("date", "<=", schema.day_name(bounds[1] // schema.DAY_MS)),
+            ("timestamp", ">=", bounds[0]),
+            ("timestamp", "<=", bounds[1]),
+        ]
+    if ping_status is not None:
+        filters.append(("ping_status", "==", ping_status))
+    if cpu_min is not None:
+        filters.append(("cpu", ">=", cpu_min))
+    if host is not None:
+        filters.append(("host", "==", host))
+
+    with perf.span("parquet"):
+        if limit is None:
+            df = pd.read_parquet(
+                compact.HISTORY_DIR,
+                columns=list(schema.COLUMNS),
+                filters=filters or None,
+                schema=compact.dataset_schema(),
+            )
+        else:
+            df = _read_newest_days(bounds, filters, limit)
+    df["timestamp"] = to_local_time(df["timestamp"])
+    return df, boundary
+
+
+def _read_newest_days(bounds, filters, limit):
+    # 分區內依時間排序，一天一天往回讀，最後接起來只留最新的 limit 筆
+    days = compact.exported_days()
+    if bounds is not None:
+        first, last = bounds[0] // schema.DAY_MS, bounds[1] // schema.DAY_MS
+        days = [day for day in days if first <= day <= last]
+    filters = [f for f in filters if f[0] != "date"]
+    parts, rows = [], 0
+    for day in reversed(days):
+        part = pd.read_parquet(
+            compact.partition_path(day),
+            columns=list(schema.COLUMNS),
+            filters=filters or None,
+            schema=compact.dataset_schema(),
+        )
+        parts.append(part)
+        rows += len(part)
+        if rows >= limit:
+            break
+    if not parts:
+        return pd.DataFrame({col: pd.Series(dtype="float64") for col in schema.COLUMNS})
+    return pd.concat(parts[::-1], ignore_index=True).tail(limit).reset_index(drop=True)
+
+
+def _read_rows(after_id: int, before_id: int = shards.MAX_ID, since_ms: int = 0, bounds=None):
+    """只讀 after_id < id < before_id 的資料列，回傳 (DataFrame, 各列的 id 陣列，由小到大)
+
+    bounds 是要查哪段時間的分片（預設 since_ms 之後全部）。
+    """
+    bounds = bounds or (since_ms, MAX_MS)
+    df = read_frame(schema.tail_query(), (after_id, before_id, since_ms), bounds)
+    return df, df.pop("id").to_numpy(dtype=np.int64)
+
+
+def _read_source(source, after_id: int):
+    """某個來源（shards.watermarks 的 key）裡 id > after_id 的資料列"""
+    lo, hi = shards.id_range(source)
+    if source is None:
+        return _read_rows(max(after_id, lo), hi)
+    day_bounds = (source * schema.DAY_MS, (source + 1) * schema.DAY_MS - 1)
+    return _read_rows(max(after_id, lo), hi, bounds=day_bounds)
+
+
+# ---------- 資料讀取（整表，所有 session 共用）----------
+class LogStore:
+    """整張 system_log 的共用快取：背景執行緒負責從 SQLite 更新，各 session 只拿 view
+
+    每次檢查先問 PRAGMA data_version（一條一直開著的連線，不碰資料表），
+    collector 有 commit 才再看 system_log 的 id 範圍、讀新資料（整表第一次被要求時才載入）。
+    新資料依來源記位置（marks，見 shards.watermarks）：開分片時補送的舊資料寫進較早的分片，
+    它的 id 比其他分片的小，只看整體的 MAX(id) 會漏掉。
+    version 只在資料真的變動時才加一，查詢快取都以它當 key，不靠固定的 TTL。
+    """
+
+    def __init__(self, db_path=DB_PATH, interval=REFRESH_SECONDS):
+        self.db_path = db_path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.version = 0
+        self.generation = 0  # 整表重讀（df 換成全新的一份）時加一
+        self.df = None
+        self.ids = np.empty(0, dtype=np.int64)  # df 尾端從 SQLite 讀來的那些列的 id
+        self.first_id = None
+        self.marks = {}  # 來源 -> 已經讀過的最大 id
+        self._probe = None
+        self._probe_inode = None
+        self._seen = None  # 上次檢查時的 (inode, data_version)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-store-refresh", daemon=True)
+
+    def start(self):
+        self.refresh()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.refresh()
+
+    def _data_version(self):
+        """(log.db 的 inode, PRAGMA data_version)；檔案被換掉時重開探測用的連線"""
+        inode = os.stat(self.db_path).st_ino
+        if self._probe is None or inode != self._probe_inode:
+            if self._probe is not None:
+                self._probe.close()
+            # 背景執行緒和按刷新的 session 都會用到（都在 self.lock 裡）
+            self._probe = db.connect_readonly(self.db_path)
+            self._probe_inode = inode
+        return inode, db.data_version(self._probe)
+
+    def refresh(self):
+        """collector 有寫入才更新；回傳 True 表示 version 變了
+
+        沒有新的 commit 時只跑一個 PRAGMA，按「立即刷新」也是同一個檢查。
+        還沒有人要過整表（frame()）時只更新 version，不讀資料。
+        """
+        with self.lock:
+            try:
+                seen = self._data_version()
+                if self.version and seen == self._seen:
+                    return False
+                replaced = self._seen is not None and seen[0] != self._seen[0]
+
+                first_id, _ = shards.extent(self._probe, "id")
+                marks = shards.watermarks(self._probe)
+                if (self.version and not replaced
+                        and first_id == self.first_id and marks == self.marks):
+                    # commit 的是別的表（ping_log 等），system_log 沒變
+                    self._seen = seen
+                    return False
+
+                if self.df is None:
+                    pass
+                # 檔案被換掉、某個來源的最大 id 變小、出現更小的 id → 整表重讀
+                elif (replaced
+                        or any(top < self.marks.get(source, top) for source, top in marks.items())
+                        or (first_id is not None and self.first_id is not None
+                            and first_id < self.first_id)):
+                    self.df, self.ids = self._read_all()
+                    self.generation += 1
+                else:
+                    # 最舊的資料被刪掉（retention）：從 df 前面拿掉，不用整表重讀
+                    if first_id != self.first_id:
+                        self._drop_deleted(first_id)
+                    # 只抓各來源比上次更新的資料列，接在原本的 DataFrame 後面
+                    changed = [
+                        source for source, top in marks.items()
+                        if top > self.marks.get(source, shards.id_range(source)[0])
+                    ]
+                    with perf.span("load_data.append"):
+                        for source in changed:
+                            new_rows, new_ids = _read_source(source, self.marks.get(source, 0))
+                            self.df = pd.concat([self.df, new_rows], ignore_index=True)
+                            self.ids = np.concatenate([self.ids, new_ids])
+                            marks = self._advance(marks, new_ids)
+                if self.df is not None:
+                    marks = self._advance(marks, self.ids)
+            except Exception:
+                return False
+
+            # 尾端都已經在快照裡時讀不到資料列，用查到的 MAX(id) 記位置
+            self.first_id, self.marks = first_id, marks
+            self._seen = seen
+            self.version += 1
+            return True
+
+    @staticmethod
+    def _advance(marks, ids):
+        """查完 watermarks 之後才 commit 的資料列也可能已經讀進來：位置推到讀到的最大 id"""
+        if not len(ids):
+            return marks
+        marks = dict(marks)
+        sources = ids // shards.SHARD_ID_SPAN if shards.enabled() else np.zeros_like(ids)
+        for key in np.unique(sources):
+            source = shards.source_of(int(key) * shards.SHARD_ID_SPAN)
+            top = int(ids[sources == key].max())
+            marks[source] = max(marks.get(source, 0), top)
+        return marks
+
+    def _read_all(self):
+        # 已經寫成 Parquet 的日期從檔案讀，SQLite 只讀之後的尾端
+        with perf.span("load_data.full"):
+            history, boundary = read_history()
+            df, ids = _read_rows(0, since_ms=boundary or 0)
+            if history is not None:
+                df = pd.concat([history, df], ignore_index=True)
+        return df, ids
+
+    def _drop_deleted(self, first_id):
+        """system_log 最舊的幾筆被刪掉了（first_id 是現在最小的 id，None 表示全空）
+
+        已經封存進 Parquet 的留在 df 裡、移到 SQLite 那一段的前面（跟整表重讀的結果一樣，
+        只是來源換成快照），其他的從 df 拿掉。
+        """
+        # 補送的資料會讓 ids 不是遞增的（開分片時），用遮罩不用二分搜尋
+        gone = np.ones(len(self.ids), dtype=bool) if first_id is None else self.ids < first_id
+        if not gone.any():
+            return
+        start = len(self.df) - len(self.ids)
+        tail = self.df.iloc[start:]
+        self.ids = self.ids[~gone]
+        boundary = compact.history_boundary() if compact.available() else None
+        if boundary is None:
+            keep = np.zeros(len(gone), dtype=bool)
+        else:
+            keep = gone & (tail["timestamp"] < pd.Timestamp(boundary, unit="ms", tz="UTC")).to_numpy()
+        self.df = pd.concat([self.df.iloc[:start], tail[keep], tail[~gone]], ignore_index=True)
+
+    def frame(self):
+        """(整表 DataFrame, generation)；第一次有人要時才讀（只看圖表的儀表板不用載入整表）"""
+        with self.lock:
+            if self.df is None:
+                try:
+                    self.df, self.ids = self._read_all()
+                except Exception:
+                    return None, self.generation
+                self.marks = self._advance(self.marks, self.ids)
+                self.generation += 1
+            return self.df, self.generation
+
+    def view(self):
+        """目前資料的淺層 view：不複製資料，copy-on-write（pandas 3 的預設）讓某個 session 改了也不影響別人"""
+        df, _ = self.frame()
+        return None if df is None else df.copy(deep=False)
+
+
+@st.cache_resource
+def log_store():
+    """整個 process 只有一個 LogStore，所有 session 共用"""
+    return LogStore().start()
 
 
-# ---------- 資料讀取 ----------
-@st.cache_data(ttl=5)
 def load_data():
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query(f"SELECT * FROM {TABLE_NAME}", conn)
-        conn.close()
+    return log_store().view()
+
 
-        # 自動找時間欄位
-        ts_col = find_time_column(df)
-        if ts_col is not None:
-            df[ts_col] = pd.to_datetime(df[ts_col])
+def shared_frame(**cache_kwargs):
+    """跟 st.cache_data 一樣依參數快取，但結果放在 st.cache_resource：
+
+    命中時不用 pickle / 複製整個 DataFrame，呼叫端拿到的是淺層 view。
+    """
+    def decorate(func):
+        cached = st.cache_resource(**cache_kwargs)(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            df = cached(*args, **kwargs)
+            return df.copy(deep=False) if isinstance(df, pd.DataFrame) else df
+
+        wrapper.clear = cached.clear
+        return wrapper
+
+    return decorate
+
+
+# ---------- 資料讀取（只讀選取的時間範圍）----------
+def window_bounds(window: str, custom_range=None):
+    """把側邊欄選的區間換算成 (開始, 結束) epoch 毫秒；「全部」回傳 None"""
+    if window == "全部":
+        return None
+    if window == "自訂":
+        start_day = custom_range[0]
+        end_day = custom_range[-1]   # 只選了一天時 tuple 只有一個元素
+        start = datetime.combine(start_day, time.min)
+        end = datetime.combine(end_day, time.max)
+    else:
+        end = datetime.now()
+        start = end - TIME_WINDOWS[window]
+    return schema.to_epoch_ms(start), schema.to_epoch_ms(end)
+
+
+@shared_frame(max_entries=SHARED_ENTRIES)
+def load_window(
+    version: int,
+    window: str,
+    custom_range=None,
+    ping_status=None,
+    cpu_min=None,
+    limit=None,
+    host=None,
+):
+    """把時間範圍和過濾條件交給 SQLite，只讀出符合的資料列
+
+    每一組參數都是獨立的 cache key，切換過濾條件不用重讀整張表；
+    version（LogStore.version）變了才會重查，collector 沒寫入就一直用同一份。
+    limit 有值時只讀最新的 limit 筆（用時間索引倒著讀）。
+    """
+    try:
+        bounds = window_bounds(window, custom_range)
+
+        # 快照涵蓋到的部分從 Parquet 讀，SQLite 只查快照之後的尾端
+        boundary = compact.history_boundary() if compact.available() else None
+        live_bounds = bounds
+        if boundary is not None:
+            start, end = bounds if bounds is not None else (0, MAX_MS)
+            live_bounds = (max(start, boundary), end)
+
+        sql, params = schema.window_query(live_bounds, ping_status, cpu_min, limit, host)
+        df = read_frame(sql, params, live_bounds, limit)
+        if limit is not None:
+            df = df.iloc[::-1].reset_index(drop=True)
+
+        # 尾端的筆數不夠 limit 時才讀歷史資料，而且只讀還缺的那幾筆
+        if boundary is not None and (limit is None or len(df) < limit):
+            missing = None if limit is None else limit - len(df)
+            history, _ = read_history(bounds, ping_status, cpu_min, host, missing)
+            if history is not None and not history.empty:
+                df = pd.concat([history, df], ignore_index=True)
         return df
     except Exception:
         return None
 
 
-# ---------- 各頁面 ----------
-def page_dashboard(df_all: pd.DataFrame):
-    """主儀表板頁面"""
-    if df_all is None or df_all.empty:
-        st.warning("找不到資料：請先回 Week 7 / 8 產生 log.db（logs 資料表）。")
-        return
+# ---------- 資料讀取（圖表數值，memmap）----------
+@st.cache_resource(max_entries=2)
+def _column_maps(rows: int, version: int):
+    """用 memmap 開啟快照的數值欄檔案（筆數或版本變了才重開），所有 session 共用同一份"""
+    return {
+        name: np.memmap(compact.column_path(name, version), dtype=np.dtype(code), mode="r", shape=(rows,))
+        for name, code in compact.COLUMN_TYPES.items()
+    }
+
+
+@shared_frame(max_entries=SHARED_ENTRIES)
+def load_live_series(version: int, window: str, custom_range, snapshot_end: int):
+    """快照之後（還在 SQLite 裡）的圖表數值
+
+    參數只放快照的結束時間、不放換算好的開始時間（那個每次 rerun 都不同），
+    version 沒變就會命中快取。
+    """
+    bounds = window_bounds(window, custom_range)
+    start, end = bounds if bounds is not None else (0, MAX_MS)
+    live_bounds = (max(start, snapshot_end), end)
+    sql, params = schema.series_query(live_bounds)
+    with read_pool().connection() as conn:
+        return query_frame(conn, sql, params, live_bounds)
+
+
+def load_series(version: int, window: str, custom_range=None):
+    """圖表用的數值序列（index 是時間）
+
+    快照涵蓋的部分直接切 memmap，不複製；只有同時跨到 SQLite 尾端時才接成一份新陣列。
+    """
+    bounds = window_bounds(window, custom_range)
+    start, end = bounds if bounds is not None else (0, MAX_MS)
+
+    parts = []
+    snapshot_end = 0
+    meta = compact.read_columns_meta()
+    if meta["rows"]:
+        maps = _column_maps(meta["rows"], meta["version"])
+        lo = int(np.searchsorted(maps["timestamp"], start, side="left"))
+        hi = int(np.searchsorted(maps["timestamp"], end, side="right"))
+        if hi > lo:
+            parts.append({name: arr[lo:hi] for name, arr in maps.items()})
+        snapshot_end = (meta["last_day"] + 1) * schema.DAY_MS
+
+    live = load_live_series(version, window, custom_range, snapshot_end)
+    if not live.empty:
+        parts.append({name: live[name].to_numpy() for name in compact.COLUMN_TYPES})
+
+    if not parts:
+        columns = {name: np.empty(0, dtype=np.dtype(code)) for name, code in compact.COLUMN_TYPES.items()}
+    elif len(parts) == 1:
+        columns = parts[0]
+    else:
+        columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+    index = to_local_index(np.asarray(columns.pop("timestamp"), dtype=np.int64))
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+@st.cache_data(max_entries=SHARED_ENTRIES)
+def load_hosts(version: int):
+    """主機選單：送過資料的主機名稱"""
+    try:
+        with read_pool().connection() as conn:
+            return [row[0] for row in conn.execute(*schema.hosts_query())]
+    except Exception:
+        return []
 
-    # 找時間欄位
-    ts_col = find_time_column(df_all)
-    if ts_col is None:
-        st.error("在資料裡找不到時間欄位（名稱裡要包含 'time'），請檢查 log.db 的欄位名稱。")
-        st.write("目前欄位：", list(df_all.columns))
-        return
 
+# ---------- 資料讀取（彙總表）----------
+@st.cache_data(max_entries=SHARED_ENTRIES)
+def load_latest(version: int, host=None):
+    """指標用的最新幾筆（新的在前），只查 LATEST_ROWS 筆，不用讀整個區間"""
+    sql, params = schema.latest_query(host, LATEST_ROWS)
+    try:
+        with read_pool().connection() as conn:
+            df = query_frame(conn, sql, params, limit=LATEST_ROWS)
+    except Exception:
+        return None
+    df["timestamp"] = to_local_time(df["timestamp"])
+    return df
+
+
+@st.cache_data(max_entries=SHARED_ENTRIES)
+def window_seconds(version: int, window: str, custom_range=None):
+    """選取區間有幾秒；「全部」就從最粗的彙總表找最早的時間"""
+    bounds = window_bounds(window, custom_range)
+    if bounds is not None:
+        return (bounds[1] - bounds[0]) / 1000
+
+    coarsest = next(iter(schema.ROLLUPS))
+    with read_pool().connection() as conn:
+        (first,) = conn.execute(f"SELECT MIN(bucket) FROM {coarsest}").fetchone()
+    if first is None:
+        return None
+    return (schema.now_ms() - first) / 1000
+
+
+def pick_rollup(version: int, window: str, custom_range, max_points: int):
+    """挑最粗、但點數還夠畫滿半張圖的彙總表；都不夠粗就回傳 None（讀原始資料）"""
+    try:
+        span = window_seconds(version, window, custom_range)
+    except Exception:
+        return None
+    if span is None:
+        return None
+    for table, seconds in schema.ROLLUPS.items():
+        if span / seconds >= max_points / 2:
+            return table
+    return None
+
+
+@shared_frame(max_entries=SHARED_ENTRIES)
+def load_rollup(version: int, table: str, window: str, custom_range=None):
+    """從彙總表讀出區間內每一桶的平均值與 UP/DOWN 次數"""
+    sql, params = schema.rollup_query(table, window_bounds(window, custom_range))
+    with read_pool().connection() as conn:
+        df = pd.read_sql_query(sql, conn, params=params)
+
+    df["bucket"] = to_local_time(df["bucket"])
+    return df
+
+
+# ---------- 即時模式 ----------
+def _filter_rows(df: pd.DataFrame, ping_status=None, cpu_min=None, host=None):
+    if host is not None:
+        df = df[df["host"] == host]
+    if ping_status is not None:
+        df = df[df["ping_status"] == ping_status]
+    if cpu_min is not None:
+        df = df[df["cpu"] >= cpu_min]
+    return df
+
+
+def _drop_seen(frame: pd.DataFrame, new_rows: pd.DataFrame) -> pd.DataFrame:
+    """new_rows 裡 (timestamp, host) 已經在 frame 的列拿掉"""
+    if new_rows.empty:
+        return new_rows
+    recent = frame[frame["timestamp"] >= new_rows["timestamp"].min()]
+
+    def keys(df):
+        return df["timestamp"].astype("int64").astype(str) + "|" + df["host"].fillna("").astype(str)
+
+    return new_rows[~keys(new_rows).isin(keys(recent))]
+
+
+def live_window(window: str, custom_range=None, ping_status=None, cpu_min=None, host=None):
+    """即時模式的資料：第一次用 load_window 讀這個時間範圍，之後每一輪只接上新 commit 的資料列
+
+    session 記著每個來源讀到哪個 id（LogStore.marks），新資料用 tail_query 依 id 讀、過濾後接上，
+    再把滑出時間範圍的舊資料切掉；開啟即時模式的成本跟時間範圍有關，跟整張表多大無關。
+    """
+    store = log_store()
+    store.refresh()  # 沒有新 commit 時只是一個 PRAGMA
+    with store.lock:
+        version, marks = store.version, dict(store.marks)
+
+    key = (window, custom_range, ping_status, cpu_min, host)
+    state = st.session_state.get("live_state")
+    # 換了條件、或某個來源的 id 變小（log.db 被換掉）→ 重新讀整個時間範圍
+    if (state is None or state["key"] != key
+            or any(marks.get(source, top) < top for source, top in state["marks"].items())):
+        frame = load_window(version, window, custom_range, ping_status, cpu_min, host=host)
+        if frame is None:
+            return None
+        seeded = True
+    else:
+        frame, seeded = state["df"], False
+        parts = []
+        for source, top in marks.items():
+            after = state["marks"].get(source, shards.id_range(source)[0])
+            if top > after:
+                new_rows, new_ids = _read_source(source, after)
+                marks = LogStore._advance(marks, new_ids)
+                parts.append(_filter_rows(new_rows, ping_status, cpu_min, host))
+        new_rows = pd.concat(parts, ignore_index=True) if parts else frame.iloc[:0]
+        if state["seeded"]:
+            # load_window 的結果可能已經包含查 marks 之後才 commit 的幾筆
+            new_rows = _drop_seen(frame, new_rows)
+        if not new_rows.empty:
+            frame = pd.concat([frame, new_rows], ignore_index=True)
+
+    # 布林遮罩切掉滑出範圍的舊資料（接上的資料不一定依時間）
+    bounds = window_bounds(window, custom_range)
+    if bounds is not None:
+        start, end = (pd.Timestamp(ms, unit="ms", tz="UTC") for ms in bounds)
+        ts = frame["timestamp"]
+        frame = frame[(ts >= start) & (ts <= end)]
+    # 圖表的降採樣要依時間排好的 index：接上的資料不是依時間來的時候才排一次
+    if not frame["timestamp"].is_monotonic_increasing:
+        frame = frame.sort_values("timestamp", kind="stable", ignore_index=True)
+
+    st.session_state["live_state"] = {
+        "key": key,
+        "marks": marks,
+        "seeded": seeded,
+        "df": frame,
+    }
+    return frame
+
+
+# ---------- 各頁面 ----------
+def page_dashboard():
+    """主儀表板頁面"""
     # ---- Sidebar filter（在 main 裡面用 sidebar 的值）----
     with st.sidebar:
         st.title("導航")
@@ -60,76 +640,190 @@ def page_dashboard(df_all: pd.DataFrame):
         st.markdown("---")
         st.subheader("控制")
 
+        window = st.selectbox("時間範圍", list(TIME_WINDOWS), index=1)
+        custom_range = None
+        if window == "自訂":
+            today = date.today()
+            custom_range = tuple(
+                st.date_input("日期區間", (today - timedelta(days=1), today))
+            )
+
+        host_filter = st.selectbox("主機", ["全部"] + load_hosts(log_store().version))
         ping_filter = st.selectbox("依 Ping 狀態過濾", ["全部", "UP", "DOWN"])
         cpu_threshold = st.slider("只標註 CPU 佔比 (%)", 0, 100, 70)
+        cpu_only = st.checkbox("只顯示 CPU 超過門檻的記錄", value=False)
+
+        # 折線圖最多畫幾個點：大約就是圖的像素寬度，多的點瀏覽器也畫不出來
+        ds_method = st.selectbox("折線圖降採樣", DOWNSAMPLE_METHODS, index=0)
+        max_points = st.number_input("折線圖最多點數（≈ 圖寬像素）", 100, 5000, 1000, step=100)
 
         refresh_clicked = st.button("立即刷新")
 
-    # 立即刷新：清掉 cache 再重跑
+        # 即時模式：只有圖表區塊定時重跑，每次只接上新寫入的資料列
+        live = st.toggle("即時模式", value=False)
+        live_seconds = None
+        if live:
+            live_seconds = st.select_slider("更新間隔（秒）", LIVE_INTERVALS, value=5)
+
+    # 立即刷新：按鈕本身就會觸發 rerun，這裡只要先檢查有沒有新的 commit，
+    # 有的話 version 變了，下面的查詢自然會重讀；沒有就什麼都不用清
     if refresh_clicked:
-        load_data.clear()
-        st.experimental_rerun()
+        log_store().refresh()
+
+    # 過濾條件一律交給 SQLite（WHERE ... = ?），沒選的條件就是 None
+    host = None if host_filter == "全部" else host_filter
+    ping_status = None if ping_filter == "全部" else ping_filter
+    cpu_min = cpu_threshold if cpu_only else None
 
-    # ---- 套用篩選 ----
-    df = df_all.copy()
+    args = (
+        window, custom_range, host, ping_status, cpu_min, cpu_threshold, ds_method, int(max_points)
+    )
+    if live:
+        # 只有指標、圖表、表格這一段每隔 live_seconds 重跑，側邊欄和整頁不動
+        st.fragment(render_live, run_every=live_seconds)(*args)
+    else:
+        with perf.span("dashboard.total"):
+            render_dashboard(*args)
+
+
+def render_live(*args):
+    with perf.span("dashboard.live_tick"):
+        render_dashboard(*args, live=True)
+
+
+def render_dashboard(
+    window,
+    custom_range,
+    host,
+    ping_status,
+    cpu_min,
+    cpu_threshold,
+    ds_method,
+    max_points,
+    live=False,
+):
+    """摘要、指標、圖表與資料表；live 時資料來自 live_window（只接上新的資料列）"""
+    rollup = None
+    df_rollup = None
+    df_series = None
+
+    with perf.span("dashboard.load"):
+        if live:
+            df_all = live_window(window, custom_range, ping_status, cpu_min, host)
+        else:
+            version = log_store().version
+            # 彙總表和 memmap 數值欄是所有主機混在一起的，選了主機就跟其他過濾一樣查原始資料
+            no_filter = host is None and ping_status is None and cpu_min is None
+
+            # 沒有逐列過濾時，長區間改讀彙總表，原始資料只讀表格要用的最新幾筆
+            rollup = pick_rollup(version, window, custom_range, max_points) if no_filter else None
+
+            if rollup is not None:
+                df_rollup = load_rollup(version, rollup, window, custom_range)
+                df_all = load_window(version, window, custom_range, limit=RECENT_ROWS)
+            # 沒有過濾：圖表直接用 memmap 的數值切片，原始資料只讀表格要用的最新幾筆
+            elif no_filter:
+                df_series = load_series(version, window, custom_range)
+                df_all = load_window(version, window, custom_range, limit=RECENT_ROWS)
+            else:
+                df_all = load_window(
+                    version, window, custom_range, ping_status, cpu_min, host=host
+                )
+
+    if df_all is None:
+        st.warning("找不到資料：請先執行 main.py 產生 log.db（system_log 資料表）。")
+        return
+
+    if df_all.empty:
+        st.info(f"「{window}」這段時間內沒有符合條件的資料，請換一個時間範圍或過濾條件。")
+        return
 
-    if ping_filter != "全部" and "Ping_Status" in df.columns:
-        df = df[df["Ping_Status"] == ping_filter]
+    # 過濾已經在 SQL（即時模式是 live_window）做完，不用再複製一份來篩選
+    df = df_all
 
     # ---- 頂部摘要 ----
-    min_ts = df_all[ts_col].min()
-    max_ts = df_all[ts_col].max()
+    if df_rollup is not None and not df_rollup.empty:
+        total_rows = int(df_rollup["samples"].sum())
+        min_ts = df_rollup["bucket"].iloc[0]
+    elif df_series is not None and not df_series.empty:
+        total_rows = len(df_series)
+        min_ts = df_series.index[0]
+    else:
+        total_rows = len(df_all)
+        min_ts = df_all["timestamp"].min()
+    # 即時模式的資料依 id 排列、不一定依時間，最新的一筆要掃整欄找
+    max_ts = df_all["timestamp"].max()
 
     st.success(
-        f"資料筆數：{len(df_all)}，時間範圍："
+        f"資料筆數：{total_rows}，時間範圍："
         f"{min_ts.strftime('%Y-%m-%d %H:%M:%S')} → {max_ts.strftime('%Y-%m-%d %H:%M:%S')}"
     )
 
-    # ---- 三個指標（最新值）----
-    latest = df_all.iloc[-1] if not df_all.empty else None
-
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        if latest is not None and "CPU" in df_all.columns:
-            st.metric("最新 CPU (%)", f"{latest['CPU']:.1f}")
-    with col2:
-        if latest is not None and "Memory" in df_all.columns:
-            st.metric("最新 Memory (%)", f"{latest['Memory']:.1f}")
-    with col3:
-        if latest is not None and "Disk" in df_all.columns:
-            st.metric("最新 Disk (%)", f"{latest['Disk']:.1f}")
+    # ---- 三個指標（最新值，跟前一筆比）----
+    # 依時間取最新的兩筆（選了主機就是那台），跟時間範圍、其他過濾無關；
+    # SQLite 裡已經沒有資料（都在 Parquet 快照）時才退回用區間的最後兩筆
+    latest = load_latest(log_store().version, host)
+    if latest is None or latest.empty:
+        latest = df_all.nlargest(LATEST_ROWS, "timestamp")
+    newest = latest.iloc[0]
+    previous = latest.iloc[1] if len(latest) > 1 else None
+
+    for tile, (col, label) in zip(st.columns(3), LABELS.items()):
+        with tile:
+            delta = None
+            if previous is not None and pd.notna(newest[col]) and pd.notna(previous[col]):
+                delta = f"{newest[col] - previous[col]:+.1f}"
+            # 使用率升高用紅色、降低用綠色
+            st.metric(f"最新 {label} (%)", f"{newest[col]:.1f}", delta=delta, delta_color="inverse")
+    st.caption(f"最新樣本：{newest['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}")
 
     st.markdown("---")
 
     # ---- 折線圖區塊 ----
-    df_chart = df.copy().set_index(ts_col)
-
-    chart_cols = [c for c in ["CPU", "Memory", "Disk"] if c in df_chart.columns]
+    if df_rollup is not None and not df_rollup.empty:
+        df_chart = df_rollup.set_index("bucket")
+        ping_counts = pd.Series(
+            {"UP": df_rollup["up_count"].sum(), "DOWN": df_rollup["down_count"].sum()}
+        )
+        st.caption(f"長區間改用彙總表 {rollup}（每桶平均值）")
+    elif df_series is not None:
+        df_chart = df_series
+        up = int(df_series["up"].sum())
+        ping_counts = pd.Series({"UP": up, "DOWN": len(df_series) - up})
+    else:
+        df_chart = df.set_index("timestamp")
+        ping_counts = df_chart["ping_status"].value_counts()
 
-    if chart_cols:
-        c1, c2 = st.columns([2, 1])
+    c1, c2 = st.columns([2, 1])
 
-        with c1:
-            st.subheader("CPU / Memory / Disk 趨勢")
-            st.line_chart(df_chart[chart_cols])
+    with c1:
+        st.subheader("CPU / Memory / Disk 趨勢")
+        # 先在伺服器端降採樣，送到瀏覽器的點數固定在 max_points 以內
+        with perf.span("dashboard.downsample"):
+            series = downsample(df_chart[list(LABELS)], ds_method, max_points)
+        with perf.span("dashboard.chart"):
+            st.line_chart(series.rename(columns=LABELS))
+        if len(series) < len(df_chart):
+            st.caption(f"已降採樣：{len(df_chart)} → {len(series)} 點（{ds_method}）")
 
-        with c2:
-            if "Ping_Status" in df_chart.columns:
-                st.subheader("Ping 狀態統計")
-                st.bar_chart(df_chart["Ping_Status"].value_counts())
+    with c2:
+        st.subheader("Ping 狀態統計")
+        st.bar_chart(ping_counts)
 
     st.markdown("---")
 
-    # ---- 資料表（只顯示最後 50 筆）----
+    # ---- 資料表（只顯示最新的 50 筆）----
     st.subheader("最近 50 筆記錄")
 
-    df_table = df_all.copy()
-    df_table[ts_col] = df_table[ts_col].dt.strftime("%Y-%m-%d %H:%M:%S")
-
-    if "CPU" in df_table.columns:
-        df_table["High_CPU"] = df_table["CPU"] >= cpu_threshold
-
-    st.dataframe(df_table.tail(50), use_container_width=True)
+    # 先切出要顯示的幾筆，再算格式化時間和 High_CPU：每次 rerun 的成本跟資料量無關
+    # 依時間取最新的幾筆（不是最後幾列），舊到新排列
+    with perf.span("dashboard.table"):
+        recent = df_all.nlargest(RECENT_ROWS, "timestamp").iloc[::-1]
+        df_table = recent.assign(
+            timestamp=recent["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S"),
+            High_CPU=recent["cpu"] >= cpu_threshold,
+        )
+        st.dataframe(df_table, use_container_width=True)
 
 
 def page_settings(df_all: pd.DataFrame):
@@ -141,13 +835,78 @@ def page_settings(df_all: pd.DataFrame):
         return
 
     st.subheader("欄位資訊")
-    st.write(list(df_all.columns))
+    st.write(schema.COLUMNS)
 
     st.subheader("Ping 狀態分布")
-    if "Ping_Status" in df_all.columns:
-        st.bar_chart(df_all["Ping_Status"].value_counts())
+    st.bar_chart(df_all["ping_status"].value_counts())
+
+
+def load_collector_spans(hours: int = 24):
+    """collector 寫進 perf_log 的計時（最近幾小時）"""
+    sql, params = schema.perf_query(schema.now_ms() - hours * 3_600_000)
+    with read_pool().connection() as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+
+def explain_queries():
+    """診斷模式記下的每個不同查詢和它的計畫，有整張表掃描的排前面"""
+    rows = []
+    with read_pool().connection() as conn:
+        for sql in dict.fromkeys(db.recorded_queries):
+            plan = db.query_plan(conn, sql)
+            scans = db.full_scans(plan, sql, schema.SMALL_TABLES)
+            rows.append({"scan": bool(scans), "query": sql, "plan": " / ".join(plan)})
+    return pd.DataFrame(rows, columns=["scan", "query", "plan"]).sort_values(
+        "scan", ascending=False, kind="stable"
+    )
+
+
+def page_perf():
+    """效能頁：各階段計時的 p50 / p95（這個儀表板 process 的 ring buffer + collector 的 perf_log）"""
+    st.header("效能")
+
+    dashboard = pd.DataFrame(perf.snapshot(), columns=["timestamp", "stage", "ms"])
+    dashboard.insert(1, "source", "dashboard")
+    try:
+        collector = load_collector_spans()
+    except Exception:
+        collector = dashboard.iloc[:0]
+
+    for title, df in (
+        (f"儀表板（最近 {perf.RING_SIZE} 筆）", dashboard),
+        ("Collector（最近 24 小時）", collector),
+    ):
+        st.subheader(title)
+        if df.empty:
+            st.info("還沒有計時資料。")
+            continue
+        records = df[["timestamp", "stage", "ms"]].itertuples(index=False)
+        st.dataframe(pd.DataFrame(perf.summary(records)).round(2), use_container_width=True)
+
+    # ---- 查詢計畫 ----
+    st.subheader("查詢計畫")
+    if not QUERY_PLAN_CHECK:
+        st.caption("以 QUERY_PLAN_CHECK=1 啟動儀表板，這裡會列出每個查詢的 EXPLAIN QUERY PLAN。")
+    elif not db.recorded_queries:
+        st.info("還沒有記錄到查詢，先到儀表板頁操作一下。")
     else:
-        st.info("資料中沒有 Ping_Status 欄位。")
+        plans = explain_queries()
+        scans = int(plans["scan"].sum())
+        if scans:
+            st.warning(f"{scans} 個查詢會整張表掃描（SCAN），請補索引或改寫查詢。")
+        else:
+            st.success("所有查詢都有用到索引。")
+        st.dataframe(plans, use_container_width=True, hide_index=True)
+
+    # ---- 匯出原始計時 ----
+    export = pd.concat([dashboard, collector], ignore_index=True)
+    export["timestamp"] = to_local_time(export["timestamp"]).dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+    st.download_button(
+        "匯出 CSV",
+        export.to_csv(index=False).encode("utf-8"),
+        file_name="perf.csv",
+        mime="text/csv",
+    )
 
 
 def page_about():
@@ -169,18 +928,20 @@ def page_about():
 
 
 def main():
-    df_all = load_data()
+    ensure_schema()
 
     # ---- 左邊真正的導航（這邊只決定頁面）----
     with st.sidebar:
         st.title("導航")
-        page = st.radio("前往", ["儀表板", "設定", "關於"], index=0)
+        page = st.radio("前往", ["儀表板", "設定", "效能", "關於"], index=0)
 
     # ---- 根據頁面顯示內容 ----
     if page == "儀表板":
-        page_dashboard(df_all)
+        page_dashboard()
     elif page == "設定":
-        page_settings(df_all)
+        page_settings(load_data())
+    elif page == "效能":
+        page_perf()
     else:
         page_about()
 
@@ -0,0 +1,78 @@
+"""量測儀表板每次 rerun 的時間，確認跟 log.db 的總筆數無關
+
+用法：python -m benchmarks.bench_render [--sizes 10000,100000,1000000] [--runs 5]
+
+每個大小各建一個暫存的 log.db，用 streamlit 的 AppTest 先跑一次暖快取，
+再量之後幾次 rerun（按鈕、滑桿這類互動就是這條路徑）的中位數。
+最大 / 最小資料量的比值超過 --max-ratio 就以 exit code 1 結束。
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from streamlit.testing.v1 import AppTest
+import streamlit as st
+
+from benchmarks.synth import make_db
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def time_reruns(workdir: str, runs: int, window: str):
+    """在 workdir（裡面有 log.db）跑 app，回傳 (第一次執行的秒數, [每次 rerun 的秒數])"""
+    # 快取是整個行程共用的，換一個 log.db 前要先清掉
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        at = AppTest.from_file(APP, default_timeout=600)
+        start = time.perf_counter()
+        at.run()
+        first = time.perf_counter() - start
+        at.sidebar.selectbox[0].set_value(window).run()  # 暖快取
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            at.run()
+            timings.append(time.perf_counter() - start)
+        return first, timings
+    finally:
+        os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--window", default="最近 1 小時")
+    parser.add_argument("--max-ratio", type=float, default=2.0)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    medians = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            start = time.perf_counter()
+            make_db(os.path.join(workdir, "log.db"), size)
+            build = time.perf_counter() - start
+            _, timings = time_reruns(workdir, args.runs, args.window)
+        medians[size] = statistics.median(timings)
+        print(
+            f"{size:>10} rows  build {build:6.1f}s  "
+            f"rerun median {medians[size] * 1000:7.1f} ms  max {max(timings) * 1000:7.1f} ms"
+        )
+
+    ratio = medians[sizes[-1]] / medians[sizes[0]]
+    print(f"rerun ratio {sizes[-1]} / {sizes[0]} rows: {ratio:.2f}x (limit {args.max_ratio}x)")
+    if ratio > args.max_ratio:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""跑一遍儀表板的各種操作，對它發出的每個查詢做 EXPLAIN QUERY PLAN，有整張表掃描就失敗
+
+用法：python -m benchmarks.plans [--rows 20000]
+
+在暫存目錄建一個 log.db（synth.make_db），以 QUERY_PLAN_CHECK=1 用 AppTest 跑過
+每個時間範圍，各自再加上主機、ping 狀態、CPU 門檻的過濾，最後讀一次整表（設定頁用的）。
+記下的查詢逐一 EXPLAIN，有整表掃描（db.full_scans）的列出來並以 exit code 1 結束，
+CI 可以拿來擋「新查詢忘了補索引」。
+"""
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+
+from streamlit.testing.v1 import AppTest
+import streamlit as st
+
+from benchmarks.bench_render import APP
+from benchmarks.run import chdir
+from benchmarks.synth import make_db
+import schema
+
+WINDOWS = ["最近 15 分鐘", "最近 1 小時", "最近 24 小時", "最近 7 天", "自訂", "全部"]
+# 每分鐘一筆：預設 20000 筆約兩週，大的時間範圍才會走到彙總表
+STEP_MS = 60_000
+
+
+def exercise(window: str):
+    """一個時間範圍：不過濾、只看一台主機、只看 DOWN、只看 CPU 超過門檻"""
+    at = AppTest.from_file(APP, default_timeout=600).run()
+    at.sidebar.selectbox[0].set_value(window).run()
+    at.sidebar.selectbox[1].set_value("node-1").run()
+    at.sidebar.selectbox[1].set_value("全部")
+    at.sidebar.selectbox[2].set_value("DOWN").run()
+    at.sidebar.selectbox[2].set_value("全部")
+    at.sidebar.checkbox[0].check().run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20_000)
+    args = parser.parse_args()
+
+    os.environ["QUERY_PLAN_CHECK"] = "1"
+    db = importlib.import_module("db")
+    with tempfile.TemporaryDirectory() as workdir, chdir(workdir):
+        make_db("log.db", args.rows, step_ms=STEP_MS)
+        st.cache_data.clear()
+        st.cache_resource.clear()
+        for window in WINDOWS:
+            exercise(window)
+        importlib.import_module("app").LogStore().frame()
+
+        conn = db.connect_readonly()
+        try:
+            plans = {sql: db.query_plan(conn, sql) for sql in dict.fromkeys(db.recorded_queries)}
+        finally:
+            conn.close()
+
+    failures = 0
+    for sql, plan in plans.items():
+        scans = db.full_scans(plan, sql, schema.SMALL_TABLES)
+        failures += bool(scans)
+        print(("SCAN " if scans else "ok   ") + " ".join(sql.split()))
+        for step in plan:
+            print(f"       {step}")
+    print(f"{len(plans)} queries, {failures} with a full table scan")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
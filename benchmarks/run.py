@@ -0,0 +1,172 @@
+"""collect → store → load → render 整條路徑的 benchmark
+
+用法：python -m benchmarks.run [--sizes 10k,1m] [--out results.json] [--thresholds FILE]
+
+每個大小各建一個暫存的 log.db（synth.make_db），依序量：
+  - collector：init_db（空的 log.db 建表）、LogWriter.add 的寫入速度（筆 / 秒）
+  - 儀表板讀取：LogStore 第一次整表讀取的時間與記憶體高峰、之後增量讀取、load_data 拿 view
+  - 畫面：AppTest 第一次執行與之後 rerun 的時間
+結果以 JSON 輸出；有門檻檔（預設 benchmarks/thresholds.json）時逐項檢查，
+超過門檻就列出來並以 exit code 1 結束，CI 可以直接拿來擋效能退步。
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import schema
+from benchmarks.bench_render import time_reruns
+from benchmarks.synth import make_db, make_rows
+
+THRESHOLDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thresholds.json")
+INSERT_ROWS = 5_000
+SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+
+def parse_size(label: str) -> int:
+    """"10k" -> 10000，"50m" -> 50000000，純數字照原樣"""
+    label = label.strip().lower()
+    if label[-1] in SUFFIXES:
+        return int(float(label[:-1]) * SUFFIXES[label[-1]])
+    return int(label)
+
+
+@contextlib.contextmanager
+def chdir(path):
+    # main.py / app.py 都用相對路徑的 log.db，切到暫存目錄裡跑
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_collector(main):
+    """init_db 在空的 log.db 上建表，再用 LogWriter 寫 INSERT_ROWS 筆"""
+    init_s, _ = timed(main.init_db)
+    writer = main.LogWriter()
+    rows = list(make_rows(INSERT_ROWS, seed=1))
+
+    def insert_all():
+        for row in rows:
+            writer.add(row)
+        writer.flush()
+
+    insert_s, _ = timed(insert_all)
+    return {"init_db_s": init_s, "insert_rows_per_s": INSERT_ROWS / insert_s}
+
+
+def bench_load(app):
+    """LogStore 整表讀取（冷）、寫入新資料後的增量讀取、load_data 拿 view"""
+    store = app.LogStore()
+    store.refresh()
+    tracemalloc.start()
+    cold_s, _ = timed(store.frame)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    main = importlib.import_module("main")
+    writer = main.LogWriter()
+    for row in make_rows(100, end_ms=schema.now_ms() + 100_000, seed=2):
+        writer.add(row)
+    writer.flush()
+    incremental_s, _ = timed(store.refresh)
+    view_s, _ = timed(store.view)
+    return {
+        "load_cold_s": cold_s,
+        "load_peak_mb": peak / 2 ** 20,
+        "frame_mb": store.df.memory_usage(deep=True).sum() / 2 ** 20,
+        "load_incremental_s": incremental_s,
+        "load_view_s": view_s,
+    }
+
+
+def bench_render(workdir, runs, window):
+    first, timings = time_reruns(workdir, runs, window)
+    return {"render_first_s": first, "render_rerun_s": statistics.median(timings)}
+
+
+def run_size(label: str, runs: int, window: str):
+    rows = parse_size(label)
+    with tempfile.TemporaryDirectory() as workdir, chdir(workdir):
+        result = {"rows": rows}
+        result["build_s"], _ = timed(make_db, "log.db", rows)
+        result.update(bench_render(workdir, runs, window))
+        result.update(bench_load(importlib.import_module("app")))
+
+    # collector 的寫入速度在另一個全新的 log.db 上量（跟資料量無關的基準）
+    with tempfile.TemporaryDirectory() as workdir, chdir(workdir):
+        result.update(bench_collector(importlib.import_module("main")))
+    return result
+
+
+def check(results, thresholds):
+    """回傳沒過的項目：門檻格式 {"10k": {"load_cold_s": {"max": 1.0}, ...}}"""
+    failures = []
+    for label, limits in thresholds.items():
+        if label not in results:
+            continue
+        for metric, bound in limits.items():
+            value = results[label].get(metric)
+            if value is None:
+                continue
+            if "max" in bound and value > bound["max"]:
+                failures.append(f"{label} {metric} = {value:.4g} > {bound['max']}")
+            if "min" in bound and value < bound["min"]:
+                failures.append(f"{label} {metric} = {value:.4g} < {bound['min']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10k,1m", help="例如 10k,1m,50m")
+    parser.add_argument("--runs", type=int, default=5, help="AppTest rerun 幾次取中位數")
+    parser.add_argument("--window", default="最近 1 小時")
+    parser.add_argument("--out", help="JSON 結果寫到這個檔案（預設印在 stdout）")
+    parser.add_argument("--thresholds", default=THRESHOLDS)
+    args = parser.parse_args()
+
+    results = {}
+    for label in args.sizes.split(","):
+        results[label.strip()] = run_size(label, args.runs, args.window)
+        print(f"{label.strip()}: done", file=sys.stderr)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "window": args.window,
+        "results": results,
+    }
+    if args.thresholds and os.path.exists(args.thresholds):
+        with open(args.thresholds, encoding="utf-8") as f:
+            report["failures"] = check(results, json.load(f))
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    for failure in report.get("failures", []):
+        print("FAIL", failure, file=sys.stderr)
+    if report.get("failures"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
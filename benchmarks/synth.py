@@ -0,0 +1,44 @@
+"""產生合成的 log.db（給 benchmark 用）"""
+import random
+
+import db
+import schema
+
+CHUNK_ROWS = 10_000
+
+
+def make_rows(count: int, step_ms: int = 1000, end_ms=None, seed: int = 0, hosts=("node-1",)):
+    """從 end_ms 往前推 count 筆、間隔 step_ms 的樣本（依時間排序，host 輪流用 hosts）"""
+    rng = random.Random(seed)
+    end_ms = schema.now_ms() if end_ms is None else end_ms
+    start = end_ms - (count - 1) * step_ms
+    for i in range(count):
+        up = rng.random() > 0.05
+        yield (
+            start + i * step_ms,
+            round(rng.uniform(0, 100), 1),
+            round(rng.uniform(20, 90), 1),
+            round(rng.uniform(40, 60), 1),
+            "UP" if up else "DOWN",
+            round(rng.uniform(5, 80), 3) if up else -1,
+            hosts[i % len(hosts)],
+        )
+
+
+def make_db(path: str, count: int, step_ms: int = 1000, end_ms=None, seed: int = 0):
+    """建一個有 count 筆資料的 log.db（走 collector 同一條寫入路徑，彙總表也會更新）"""
+    conn = db.connect(path)
+    try:
+        schema.migrate(conn)
+        chunk = []
+        for row in make_rows(count, step_ms, end_ms, seed):
+            chunk.append(row)
+            if len(chunk) >= CHUNK_ROWS:
+                with conn:
+                    schema.insert_samples(conn, chunk)
+                chunk = []
+        if chunk:
+            with conn:
+                schema.insert_samples(conn, chunk)
+    finally:
+        conn.close()
@@ -0,0 +1,357 @@
+import json
+import os
+from array import array
+
+import db
+import schema
+import shards
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow 是選用套件：沒裝就不做欄式快照，全部照舊從 SQLite 讀
+    pa = None
+    pq = None
+
+# 已經結束的日期（UTC）不會再變動，整天寫成一個 Parquet 檔：
+#   history/system_log/date=2026-10-16/part.parquet
+HISTORY_DIR = os.path.join("history", schema.TABLE)
+# 一天結束後再等一小時才匯出，讓 collector 緩衝區裡的最後幾筆先寫進 SQLite
+SETTLE_MS = 3_600_000
+# 每一天匯出時讀到的最大 id：agent 斷線後補送的舊資料（最多約 MAX_BACKLOG 筆）id 會比它大，
+# 下次 compact 看到就把那一天重新寫一次
+EXPORTED_FILE = "_exported.json"  # 底線開頭：pyarrow 讀整個目錄時會略過
+
+ARROW_TYPES = {"INTEGER": "int64", "REAL": "float64", "TEXT": "string"}
+
+# 圖表用的數值欄另外存成連續的原始陣列檔（每欄一個檔、依時間排序、只會往後接），
+# 儀表板用 numpy.memmap 開啟，時間範圍就是切片，不用複製資料：
+#   history/columns/timestamp.i8、cpu.f8 ...，筆數記在 meta.json
+# 補送的資料讓舊的日期重寫時，整組重建到 history/columns/v<版本>/，meta.json 記著現在是哪一版
+COLUMNS_DIR = os.path.join("history", "columns")
+# 欄位 -> array typecode（up 是 ping_status == "UP" 的 0/1）
+COLUMN_TYPES = {
+    "timestamp": "q",
+    "cpu": "d",
+    "memory": "d",
+    "disk": "d",
+    "ping_ms": "d",
+    "up": "b",
+}
+COLUMN_SUFFIX = {"q": "i8", "d": "f8", "b": "i1"}
+# 數值欄檔案是從 Parquet 的這幾欄算出來的
+SOURCE_COLUMNS = ["timestamp", "cpu", "memory", "disk", "ping_status", "ping_ms"]
+
+
+def available():
+    return pa is not None
+
+
+def partition_path(day: int, root=HISTORY_DIR):
+    return os.path.join(root, f"date={schema.day_name(day)}", "part.parquet")
+
+
+def exported_days(root=HISTORY_DIR):
+    """已經寫成檔案的日期（epoch 天數），由小到大"""
+    if not os.path.isdir(root):
+        return []
+    days = []
+    for name in os.listdir(root):
+        if name.startswith("date=") and os.path.exists(os.path.join(root, name, "part.parquet")):
+            days.append(schema.day_number(name[len("date="):]))
+    return sorted(days)
+
+
+def history_boundary(root=HISTORY_DIR):
+    """Parquet 檔涵蓋到哪個時間點（epoch 毫秒，不含）；沒有任何快照就回傳 None
+
+    比這個時間早的資料從檔案讀，之後的（還在變動的尾端）才查 SQLite。
+    """
+    days = exported_days(root)
+    if not days:
+        return None
+    return (days[-1] + 1) * schema.DAY_MS
+
+
+def _arrow_schema():
+    return pa.schema(
+        [(col, ARROW_TYPES[sql_type.split()[0]]) for col, sql_type in schema.COLUMNS.items()]
+    )
+
+
+def dataset_schema():
+    """讀整個 history 目錄用的 schema（含 date 分區欄）
+
+    較早匯出的檔案沒有後來才加的欄位（例如 v4 的 host），照這個 schema 讀會補成 null。
+    """
+    return _arrow_schema().append(pa.field("date", pa.string()))
+
+
+def _day_bounds(day: int):
+    return day * schema.DAY_MS, (day + 1) * schema.DAY_MS - 1
+
+
+def read_exported_ids(root=HISTORY_DIR):
+    """{日期名稱: 匯出時的最大 id}；較早匯出、還沒記錄的日期不在裡面"""
+    try:
+        with open(os.path.join(root, EXPORTED_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_exported_ids(ids, root=HISTORY_DIR):
+    os.makedirs(root, exist_ok=True)
+    tmp_path = os.path.join(root, EXPORTED_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(ids, f, sort_keys=True)
+    os.replace(tmp_path, os.path.join(root, EXPORTED_FILE))
+
+
+def _max_id(conn, day: int):
+    """SQLite 裡這一天的最大 id（沒有資料列就是 None）"""
+    bounds = _day_bounds(day)
+    _, rows = shards.read(
+        conn, f"SELECT MAX(id) FROM {schema.TABLE} WHERE timestamp BETWEEN ? AND ?", bounds, bounds
+    )
+    return max((row[0] for row in rows if row[0] is not None), default=None)
+
+
+def _write_partition(table, day: int, root=HISTORY_DIR):
+    # 先寫暫存檔再改名，讀的人不會看到寫一半的檔；暫存檔以底線開頭，
+    # 讀整個目錄（pd.read_parquet(HISTORY_DIR)）時 pyarrow 會略過它
+    path = partition_path(day, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(path), "_" + os.path.basename(path) + ".tmp")
+    pq.write_table(table, tmp_path, compression="zstd", row_group_size=64_000)
+    os.replace(tmp_path, path)
+
+
+def _read_day(conn, day: int, after_id: int = 0):
+    """SQLite 裡這一天 id > after_id 的資料列（依時間排序），回傳 (Arrow table, 讀到的最大 id 或 None)
+
+    id 跟資料列用同一個查詢讀：記下的位置就是實際寫進檔案的那些列，
+    中間才 commit 的補送資料不會被寫進去又在下一輪重複併一次。
+    """
+    bounds = _day_bounds(day)
+    where, params = schema.where_clause(bounds)
+    sql = (
+        f"SELECT id, {schema.SELECT_COLUMNS} FROM {schema.TABLE} "
+        f"{where} AND id > ? ORDER BY timestamp"
+    )
+    _, rows = shards.read(conn, sql, (*params, after_id), bounds)
+    ids, *columns = list(zip(*rows)) if rows else [[] for _ in range(len(schema.COLUMNS) + 1)]
+    table = pa.Table.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, _arrow_schema())],
+        schema=_arrow_schema(),
+    )
+    return table, max(ids, default=None)
+
+
+def _record_exported(day: int, max_id: int, root=HISTORY_DIR):
+    ids = read_exported_ids(root)
+    ids[schema.day_name(day)] = max_id
+    _write_exported_ids(ids, root)
+
+
+def export_day(conn, day: int, root=HISTORY_DIR):
+    """把某一天的 system_log 寫成 Parquet，回傳寫了幾筆"""
+    table, max_id = _read_day(conn, day)
+    _write_partition(table, day, root)
+    _record_exported(day, max_id or 0, root)
+    return table.num_rows
+
+
+def merge_late_rows(conn, day: int, after_id: int, root=HISTORY_DIR):
+    """已經匯出的日期又收到 id > after_id 的資料（補送的舊樣本）：併進原本的 Parquet 重寫
+
+    SQLite 裡這一天較早的資料可能已經被 retention 刪掉，所以是舊檔加上新的列，不是整天重匯。
+    回傳併進去幾筆。
+    """
+    late, max_id = _read_day(conn, day, after_id)
+    if not late.num_rows:
+        return 0
+    old = pq.read_table(partition_path(day, root), schema=_arrow_schema())
+    merged = pa.concat_tables([old, late]).sort_by("timestamp")
+    _write_partition(merged, day, root)
+    _record_exported(day, max_id, root)
+    return late.num_rows
+
+
+def column_dir(version=0, columns_dir=COLUMNS_DIR):
+    """某個版本的數值欄目錄：版本 0 直接放在 columns_dir，重建過的放在 columns_dir/v<版本>"""
+    return columns_dir if not version else os.path.join(columns_dir, f"v{version}")
+
+
+def column_path(name, version=0, columns_dir=COLUMNS_DIR):
+    return os.path.join(column_dir(version, columns_dir), f"{name}.{COLUMN_SUFFIX[COLUMN_TYPES[name]]}")
+
+
+def read_columns_meta(columns_dir=COLUMNS_DIR):
+    """{"rows": 已寫入的筆數, "first_day": ..., "last_day": ..., "version": 檔案在哪個版本的目錄}
+
+    還沒有就回傳空的。
+    """
+    try:
+        with open(os.path.join(columns_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        meta = {"rows": 0, "first_day": None, "last_day": None}
+    meta.setdefault("offsets", {})
+    meta.setdefault("version", 0)
+    return meta
+
+
+def _write_columns_meta(meta, columns_dir=COLUMNS_DIR):
+    os.makedirs(columns_dir, exist_ok=True)
+    tmp_path = os.path.join(columns_dir, "meta.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(columns_dir, "meta.json"))
+
+
+def _append_columns(day, table, meta, columns_dir=COLUMNS_DIR):
+    """把一天的資料接到 meta 那個版本的檔案後面，回傳新的 meta（由呼叫端寫回）
+
+    檔案只會變長：儀表板 memmap 著前面 meta["rows"] 筆，那一段不會被改寫也不會被截掉。
+    """
+    data = table.to_pydict()
+    values = {
+        "timestamp": data["timestamp"],
+        "up": [1 if status == "UP" else 0 for status in data["ping_status"]],
+    }
+    for col in ("cpu", "memory", "disk", "ping_ms"):
+        values[col] = [float("nan") if v is None else v for v in data[col]]
+
+    # 從 meta 記錄的筆數之後開始寫：上次寫到一半當掉留下的尾巴會被蓋掉
+    os.makedirs(column_dir(meta["version"], columns_dir), exist_ok=True)
+    for name, typecode in COLUMN_TYPES.items():
+        path = column_path(name, meta["version"], columns_dir)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.seek(meta["rows"] * array(typecode).itemsize)
+            array(typecode, values[name]).tofile(f)
+            f.truncate()
+
+    return {
+        "rows": meta["rows"] + table.num_rows,
+        "first_day": day if meta["first_day"] is None else meta["first_day"],
+        "last_day": day,
+        # 各天在檔案裡的起點：補送的資料讓某天重寫時，前面的天數可以直接沿用
+        "offsets": {**meta["offsets"], str(day): meta["rows"]},
+        "version": meta["version"],
+    }
+
+
+def _copy_prefix(src, dst, size):
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        while size > 0:
+            chunk = fin.read(min(size, 1 << 20))
+            if not chunk:
+                break
+            fout.write(chunk)
+            size -= len(chunk)
+
+
+def _remove_old_versions(current, columns_dir=COLUMNS_DIR):
+    # 只留現在和上一個版本：剛讀到舊 meta、還沒開檔的 session 仍然找得到上一版。
+    # 更早的版本直接刪，已經 memmap 著的人手上的 inode 不受影響
+    for version in range(current - 1):
+        path = column_dir(version, columns_dir)
+        for name in COLUMN_TYPES:
+            old = column_path(name, version, columns_dir)
+            if os.path.exists(old):
+                os.remove(old)
+        if version and os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+
+
+def rebuild_columns(day, root=HISTORY_DIR, columns_dir=COLUMNS_DIR):
+    """day 的 Parquet 重寫過（併進補送的資料）：從那一天起重新產生數值欄
+
+    儀表板正 memmap 著現在的檔案，不能縮短或就地改寫（讀到檔尾之後會 SIGBUS），
+    所以寫到新版本的目錄：day 之前的部分從舊檔複製，之後逐天重接，最後才把 meta.json 切過去。
+    """
+    old = read_columns_meta(columns_dir)
+    start = old["offsets"].get(str(day))
+    if old["first_day"] is None or day <= old["first_day"]:
+        start = None
+    meta = {"rows": 0, "first_day": None, "last_day": None, "offsets": {}, "version": old["version"] + 1}
+    os.makedirs(column_dir(meta["version"], columns_dir), exist_ok=True)
+    if start:
+        for name, typecode in COLUMN_TYPES.items():
+            _copy_prefix(
+                column_path(name, old["version"], columns_dir),
+                column_path(name, meta["version"], columns_dir),
+                start * array(typecode).itemsize,
+            )
+        meta.update(
+            rows=start,
+            first_day=old["first_day"],
+            last_day=day - 1,
+            offsets={d: rows for d, rows in old["offsets"].items() if int(d) < day},
+        )
+    for exported in exported_days(root):
+        if meta["last_day"] is None or exported > meta["last_day"]:
+            table = pq.read_table(partition_path(exported, root), columns=SOURCE_COLUMNS)
+            meta = _append_columns(exported, table, meta, columns_dir)
+    _write_columns_meta(meta, columns_dir)
+    _remove_old_versions(meta["version"], columns_dir)
+
+
+def sync_columns(root=HISTORY_DIR, columns_dir=COLUMNS_DIR):
+    """把還沒接上的 Parquet 日期依序接到數值欄檔案後面"""
+    meta = read_columns_meta(columns_dir)
+    for day in exported_days(root):
+        if meta["last_day"] is None or day > meta["last_day"]:
+            table = pq.read_table(partition_path(day, root), columns=SOURCE_COLUMNS)
+            meta = _append_columns(day, table, meta, columns_dir)
+            _write_columns_meta(meta, columns_dir)
+
+
+def compact(conn, root=HISTORY_DIR):
+    """把所有已結束、還沒匯出的日期寫成 Parquet；回傳 {日期: 筆數}
+
+    已經匯出的日期如果又收到補送的資料（id 比匯出時大），併進原本的檔案重寫，
+    數值欄檔案也從那一天開始重建（寫到新版本的目錄）。
+    """
+    if not available():
+        return {}
+
+    first, last = shards.extent(conn, "timestamp")
+    if first is None:
+        return {}
+
+    today = (schema.now_ms() - SETTLE_MS) // schema.DAY_MS
+    done = set(exported_days(root))
+    exported_ids = read_exported_ids(root)
+    exported = {}
+    rewritten = []
+    for day in range(first // schema.DAY_MS, min(last // schema.DAY_MS + 1, today)):
+        if day not in done:
+            exported[schema.day_name(day)] = export_day(conn, day, root)
+            continue
+        after_id = exported_ids.get(schema.day_name(day))
+        if after_id is None:
+            # 這個記錄出現之前匯出的日期：從現在的最大 id 開始記
+            exported_ids[schema.day_name(day)] = _max_id(conn, day) or 0
+            _write_exported_ids(exported_ids, root)
+            continue
+        late = merge_late_rows(conn, day, after_id, root)
+        if late:
+            exported[schema.day_name(day)] = late
+            rewritten.append(day)
+    if rewritten:
+        rebuild_columns(min(rewritten), root)
+    sync_columns(root)
+    return exported
+
+
+if __name__ == "__main__":
+    if not available():
+        raise SystemExit("需要 pyarrow：pip install pyarrow")
+    conn = db.connect()
+    try:
+        for name, count in compact(conn).items():
+            print(f"{name}: {count} rows")
+    finally:
+        conn.close()
@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+DB_PATH = "log.db"
+
+# collector（main.py）和儀表板（app.py）共用的連線設定
+PRAGMAS = {
+    "journal_mode": "WAL",      # 讀寫可以同時進行，讀的人不會擋住寫入
+    "synchronous": "NORMAL",    # WAL 模式下只在 checkpoint 時 fsync
+    "cache_size": -20000,       # 負數單位是 KiB，約 20 MB page cache
+    "mmap_size": 268435456,     # 256 MB 記憶體映射讀取
+    "busy_timeout": 5000,       # 被鎖住時最多等 5 秒，不直接丟 database is locked
+    "temp_store": "MEMORY",
+}
+# 唯讀連線只需要影響讀取的設定（journal_mode / synchronous 是寫入端的事）
+READ_PRAGMAS = ("cache_size", "mmap_size", "busy_timeout", "temp_store")
+
+POOL_SIZE = 4               # 連線池最多留幾條閒置的唯讀連線
+CACHED_STATEMENTS = 256     # 每條連線快取幾個編譯好的 SQL（sqlite3 預設 128）
+
+# 查詢計畫檢查（儀表板設 QUERY_PLAN_CHECK=1 時開啟）：唯讀連線跑過的 SELECT，參數已經代入
+recorded_queries = deque(maxlen=500)
+
+
+def connect(path: str = DB_PATH, check_same_thread: bool = True) -> sqlite3.Connection:
+    """開一條套好 PRAGMA 的 SQLite 連線"""
+    conn = sqlite3.connect(
+        path, timeout=PRAGMAS["busy_timeout"] / 1000, check_same_thread=check_same_thread
+    )
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def connect_readonly(path: str = DB_PATH, trace=None) -> sqlite3.Connection:
+    """開一條唯讀連線（URI mode=ro），可以交給別的執行緒用，但同一時間只能一個人用
+
+    trace 有給時，這條連線執行的每個 SQL（參數已代入）都會傳給它（例如 record_query）。
+    """
+    conn = sqlite3.connect(
+        f"file:{os.path.abspath(path)}?mode=ro",
+        uri=True,
+        timeout=PRAGMAS["busy_timeout"] / 1000,
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    for name in READ_PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {PRAGMAS[name]}")
+    if trace is not None:
+        conn.set_trace_callback(trace)
+    return conn
+
+
+def data_version(conn: sqlite3.Connection) -> int:
+    """PRAGMA data_version：其他連線 commit 之後才會變
+
+    只跟同一條連線之前的值比較才有意義，所以要用一條一直開著的連線來問。
+    """
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+def record_query(sql: str):
+    """trace callback：只留下讀資料的 SELECT（健康檢查的 SELECT 1、PRAGMA、EXPLAIN 不算）"""
+    statement = sql.strip()
+    if statement.upper().startswith(("SELECT", "WITH")) and statement != "SELECT 1":
+        recorded_queries.append(statement)
+
+
+def query_plan(conn: sqlite3.Connection, sql: str, params=()):
+    """EXPLAIN QUERY PLAN 的每一步（detail 欄，例如 "SEARCH system_log USING INDEX ..."）"""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def full_scans(plan, sql="", small_tables=()):
+    """計畫裡把整張表從頭掃到尾的步驟
+
+    SCAN <表> 不管有沒有用索引都算：沿著索引依序掃整張表（例如只有 ORDER BY 用得上索引）
+    一樣會讀完每一列。只有 sql 帶 LIMIT 的索引掃描（讀到幾筆就停）不算；
+    small_tables（彙總表、hosts 這種小表）、子查詢和常數列也不算。
+    """
+    limited = " LIMIT " in f" {' '.join(sql.upper().split())} "
+    scans = []
+    for step in plan:
+        if not step.startswith("SCAN ") or step.startswith(("SCAN (", "SCAN CONSTANT")):
+            continue
+        if step.split()[1] in small_tables or (limited and " USING " in step):
+            continue
+        scans.append(step)
+    return scans
+
+
+class ReadPool:
+    """儀表板用的唯讀連線池
+
+    連線用完放回池子，下次直接拿來用：page cache、schema 和編譯好的 SQL 都還在。
+    拿出來時先確認 log.db 沒有被換掉（inode 變了就把舊連線全部丟掉），
+    再跑一個 SELECT 1 當健康檢查；使用中出錯的連線不會放回去。
+    """
+
+    def __init__(self, path: str = DB_PATH, size: int = POOL_SIZE, trace=None):
+        self.path = path
+        self.size = size
+        self.trace = trace
+        self.lock = threading.Lock()
+        self._idle = []
+        self._inode = None
+
+    def _current_inode(self):
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def _checkout(self):
+        inode = self._current_inode()
+        with self.lock:
+            if inode != self._inode:
+                # log.db 被換掉（還原備份、重建）：舊連線還指著舊檔案
+                stale, self._idle = self._idle, []
+                self._inode = inode
+            else:
+                stale = []
+            conn = self._idle.pop() if self._idle else None
+        for old in stale:
+            old.close()
+
+        if conn is not None:
+            try:
+                conn.execute("SELECT 1").fetchone()
+                return conn, inode
+            except sqlite3.Error:
+                conn.close()
+        return connect_readonly(self.path, self.trace), inode
+
+    def _checkin(self, conn, inode):
+        with self.lock:
+            if inode == self._inode and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: ...（離開時自動還回池子）"""
+        conn, inode = self._checkout()
+        ok = False
+        try:
+            yield conn
+            ok = True
+        finally:
+            # 用的時候出錯就不放回去，下一次開新的
+            if ok:
+                self._checkin(conn, inode)
+            else:
+                conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
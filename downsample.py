@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+# 側邊欄可以選的降採樣方式
+METHODS = ["LTTB", "平均", "最小/最大", "不降採樣"]
+
+
+# ---------- 時間分桶 ----------
+def _bucket_freq(index: pd.DatetimeIndex, n_buckets: int):
+    """把整段時間切成 n_buckets 等份，回傳每一桶的寬度"""
+    span = index[-1] - index[0]
+    return max(span / max(n_buckets, 1), pd.Timedelta(milliseconds=1))
+
+
+def bucket_mean(df: pd.DataFrame, max_points: int) -> pd.DataFrame:
+    """每個時間桶取平均，最多輸出 max_points 個點"""
+    if len(df) <= max_points:
+        return df
+    freq = _bucket_freq(df.index, max_points)
+    return df.resample(freq).mean().dropna(how="all")
+
+
+def bucket_minmax(df: pd.DataFrame, max_points: int) -> pd.DataFrame:
+    """每個時間桶輸出最小值和最大值兩個點，保留尖峰，最多 max_points 個點"""
+    if len(df) <= max_points:
+        return df
+    freq = _bucket_freq(df.index, max_points // 2)
+    resampled = df.resample(freq)
+    lows = resampled.min()
+    highs = resampled.max()
+    # 最大值放在桶的中間，折線就會畫出每一桶的上下範圍
+    highs.index = highs.index + freq / 2
+    return pd.concat([lows, highs]).sort_index().dropna(how="all")
+
+
+# ---------- LTTB ----------
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets：挑出 n_out 個最能保留折線形狀的點的位置"""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # 頭尾固定保留，中間分成 n_out - 2 個桶
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    picked = np.empty(n_out, dtype=np.int64)
+    picked[0] = 0
+    picked[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # 下一桶的平均點（最後一桶就用最後一個點）
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+
+        # 三角形面積（省略 1/2）最大的點就是這一桶的代表
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        picked[i + 1] = a
+
+    return picked
+
+
+def lttb(df: pd.DataFrame, max_points: int) -> pd.DataFrame:
+    """對每個欄位各跑一次 LTTB，取所有被選中的列，總點數不超過 max_points"""
+    if len(df) <= max_points or df.empty:
+        return df
+
+    x = df.index.asi8.astype(np.float64)
+    per_column = max(max_points // max(len(df.columns), 1), 3)
+
+    keep = set()
+    for col in df.columns:
+        y = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        y = np.nan_to_num(y, nan=np.nanmean(y) if np.isfinite(y).any() else 0.0)
+        keep.update(lttb_indices(x, y, per_column).tolist())
+
+    return df.iloc[sorted(keep)]
+
+
+# ---------- 入口 ----------
+def downsample(df: pd.DataFrame, method: str, max_points: int) -> pd.DataFrame:
+    """依側邊欄選的方式降採樣（df 要用時間當 index，且已依時間排序）"""
+    if method == "LTTB":
+        return lttb(df, max_points)
+    if method == "平均":
+        return bucket_mean(df, max_points)
+    if method == "最小/最大":
+        return bucket_minmax(df, max_points)
+    return df
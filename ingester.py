@@ -0,0 +1,144 @@
+import argparse
+import json
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import compact
+import main
+import schema
+
+# 接收各台 agent（main.py --agent URL）POST 來的樣本，集中批次寫進 log.db
+LISTEN_HOST = "0.0.0.0"
+LISTEN_PORT = 8765
+INGEST_PATH = "/ingest"
+
+# 大批寫入：累積 5000 筆或 1 秒寫一次；彙總表每 10 秒更新一次（由 1 分鐘桶往上合併）
+BATCH_ROWS = 5000
+BATCH_SECONDS = 1
+ROLLUP_SECONDS = 10
+MAX_BODY = 16 * 2 ** 20  # 單一請求最大 16 MB
+
+writer = main.LogWriter(
+    max_rows=BATCH_ROWS, max_seconds=BATCH_SECONDS, rollup_seconds=ROLLUP_SECONDS
+)
+flush_now = threading.Event()  # 緩衝區滿了，叫 flush_loop 不用等到下一個週期
+
+
+def _valid(value, sql_type):
+    # 型別照 schema 的欄位：INTEGER 是整數（時間戳記）、REAL 是數字或 null、TEXT 是字串
+    if isinstance(value, bool):
+        return False
+    if sql_type.startswith("INTEGER"):
+        return isinstance(value, int)
+    if sql_type.startswith("REAL"):
+        return value is None or isinstance(value, (int, float))
+    return isinstance(value, str)
+
+
+def _check_fields(kind, records, columns):
+    for i, record in enumerate(records):
+        if len(record) != len(columns):
+            raise ValueError(f"each {kind} needs {len(columns)} fields: {', '.join(columns)}")
+        for value, (col, sql_type) in zip(record, columns.items()):
+            if not _valid(value, sql_type):
+                raise ValueError(f"{kind} {i}: bad {col} {value!r} (expected {sql_type.split()[0]})")
+
+
+def parse_batch(body):
+    """{"rows": [[timestamp, cpu, ..., host], ...], "pings": [[timestamp, target, status, ms], ...]}
+
+    每一欄都檢查型別，有一筆不對就整個請求回 400：壞掉的資料列進了寫入緩衝區，
+    之後每次 flush 都會失敗。
+    """
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("body must be a JSON object")
+    rows = [tuple(row) for row in payload.get("rows", [])]
+    pings = [tuple(ping) for ping in payload.get("pings", [])]
+    _check_fields("row", rows, schema.COLUMNS)
+    _check_fields("ping", pings, schema.PING_COLUMNS)
+    return rows, pings
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != INGEST_PATH:
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_BODY:
+            self.send_error(413)
+            return
+        try:
+            rows, pings = parse_batch(self.rfile.read(length))
+        except (ValueError, TypeError) as exc:
+            self.send_error(400, str(exc))
+            return
+        # LogWriter 自己有鎖，各個連線的 thread 直接丟進同一個緩衝區；
+        # 寫進 SQLite 交給 flush_loop：寫入失敗也不會讓已經收下的資料被 agent 重送
+        with writer.lock:
+            writer.buffer.extend(rows)
+            writer.ping_buffer.extend(pings)
+            full = len(writer.buffer) >= writer.max_rows
+        if full:
+            flush_now.set()
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass  # 每個請求都印一行太吵
+
+
+class IngestServer(ThreadingHTTPServer):
+    # 幾百台 agent 同時連進來：listen backlog 預設只有 5，會被直接 reset
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def flush_loop(stop, period=BATCH_SECONDS):
+    # 每 period 秒（緩衝區滿了就馬上）把緩衝區和彙總表寫出去；快照與過期資料交給 main 的維護執行緒
+    next_retention = next_compaction = time.monotonic()
+    while not stop.is_set():
+        flush_now.wait(period)
+        flush_now.clear()
+        try:
+            writer.flush()
+        except Exception as exc:
+            print("Flush failed, will retry:", exc, file=sys.stderr)
+        # 跟單機的 collector 一樣：已結束的日期寫成 Parquet，封存過的原始資料才會被 retention 刪掉
+        if compact.available() and time.monotonic() >= next_compaction:
+            next_compaction = time.monotonic() + main.COMPACT_SECONDS
+            main.maintenance_pool.submit(main.run_compaction)
+        if time.monotonic() >= next_retention:
+            next_retention = time.monotonic() + main.RETENTION_SECONDS
+            main.maintenance_pool.submit(main.run_retention)
+
+
+def serve(host=LISTEN_HOST, port=LISTEN_PORT):
+    main.init_db()
+    server = IngestServer((host, port), IngestHandler)
+    stop = threading.Event()
+    flusher = threading.Thread(target=flush_loop, args=(stop,), daemon=True)
+    flusher.start()
+    print(f"Ingesting on http://{host}:{port}{INGEST_PATH} into {writer.db_name}")
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        flush_now.set()
+        flusher.join()
+        server.server_close()
+        writer.flush()
+        writer.flush_rollups()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Receive samples from main.py --agent")
+    parser.add_argument("--host", default=LISTEN_HOST)
+    parser.add_argument("--port", type=int, default=LISTEN_PORT)
+    args = parser.parse_args()
+    signal.signal(signal.SIGTERM, main.handle_sigterm)
+    serve(args.host, args.port)
@@ -1,71 +1,297 @@
-import psutil
-from datetime import datetime
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import argparse
+import atexit
+import json
+import math
+import signal
+import socket
 import os
+import sys
+import threading
 import time
-import subprocess
-import platform
+import urllib.error
+import urllib.request
 
-DB_NAME = "log.db"
+try:
+    import psutil
+except ImportError:  # only the collector needs it; ingester.py reuses LogWriter without it
+    psutil = None
+
+import compact
+import db
+import perf
+import prober
+import retention
+import schema
+import shards
+
+DB_NAME = db.DB_PATH
+
+# 寫入緩衝：累積到幾筆或幾秒就一次寫進 SQLite
+FLUSH_ROWS = 50
+FLUSH_SECONDS = 30
+
+# 取樣週期固定，ping 在背景執行、超時就算 DOWN
+SAMPLE_SECONDS = 10
+PING_TIMEOUT = prober.PROBE_TIMEOUT
+# 要探測的目標（逗號分隔，"host:port" 表示 TCP connect）；第一個寫進 system_log 的 ping_status
+PROBE_TARGETS = [
+    t.strip() for t in os.environ.get("PROBE_TARGETS", "8.8.8.8").split(",") if t.strip()
+]
+
+# 每小時檢查一次有沒有已結束的日期可以寫成 Parquet 快照
+COMPACT_SECONDS = 3600
+# 過期資料多久清一次（規則在 retention.RULES，LOG_RETENTION 可以覆蓋）
+RETENTION_SECONDS = 600
+
+# 這台機器在 system_log.host 裡的名字
+HOST = os.environ.get("COLLECTOR_HOST") or socket.gethostname()
+
+# agent 模式：樣本不寫本機的 log.db，而是 POST 給 ingester.py
+PUSH_ROWS = 1  # 每個樣本都馬上送，儀表板不用等
+PUSH_TIMEOUT = 5
+MAX_BACKLOG = 10_000  # ingester 連不上時最多在記憶體裡留幾筆，超過就丟最舊的
+
+ping_pool = ThreadPoolExecutor(max_workers=4)
+maintenance_pool = ThreadPoolExecutor(max_workers=1)
 
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS system_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            cpu REAL,
-            memory REAL,
-            disk REAL,
-            ping_status TEXT,
-            ping_ms REAL
-        )
-    """)
-    conn.commit()
-    conn.close()
+    conn = db.connect(DB_NAME)
+    try:
+        schema.migrate(conn)
+    finally:
+        conn.close()
+
+def collect_sample():
+    now = schema.now_ms()
+    # start the probes first so they run while the local metrics are read
+    probe_future = ping_pool.submit(prober.run_probes, PROBE_TARGETS, PING_TIMEOUT)
+    with perf.span("collect.sample"):
+        cpu = psutil.cpu_percent(interval=None)  # usage since the previous call, does not block
+        memory = psutil.virtual_memory().percent
+        disk = psutil.disk_usage('/').percent
+    # only the time still spent waiting after the local metrics are read
+    with perf.span("collect.ping"):
+        try:
+            results = probe_future.result(timeout=PING_TIMEOUT + 1)
+        except FutureTimeout:
+            results = [(target, "DOWN", -1) for target in PROBE_TARGETS]
+    _, ping_status, ping_ms = results[0]
+    row = (now, cpu, memory, disk, ping_status, ping_ms, HOST)
+    return row, [(now, target, status, ms) for target, status, ms in results]
 
 def get_system_info():
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cpu = psutil.cpu_percent(interval=1)
-    memory = psutil.virtual_memory().percent
-    disk = psutil.disk_usage('/').percent
-    ping_status, ping_ms = ping_host("8.8.8.8")
-    return (now, cpu, memory, disk, ping_status, ping_ms)
-
-def ping_host(host):
-    try:
-        param = "-n" if platform.system().lower() == "windows" else "-c"
-        output = subprocess.check_output(["ping", param, "1", host], stderr=subprocess.DEVNULL).decode()
-        ms = parse_ping_time(output)
-        return ("UP", ms)
-    except:
-        return ("DOWN", -1)
-
-def parse_ping_time(output):
-    for line in output.splitlines():
-        if "time=" in line:
-            parts = line.split("time=")
-            if len(parts) > 1:
+    return collect_sample()[0]
+
+def ping_host(host, timeout=PING_TIMEOUT):
+    return prober.run_probes([host], timeout)[0][1:]
+
+def run_every(period, task, count=None):
+    # Ticks are scheduled from the start time (not "sleep after work"), so the period never drifts
+    next_tick = time.monotonic()
+    done = 0
+    while True:
+        task()
+        done += 1
+        if count is not None and done >= count:
+            return
+        next_tick += period
+        delay = next_tick - time.monotonic()
+        if delay < 0:
+            # a tick overran: skip the missed slots instead of firing them back-to-back
+            next_tick += math.ceil(-delay / period) * period
+            delay = next_tick - time.monotonic()
+        time.sleep(delay)
+
+class LogWriter:
+    # Buffers samples in memory and writes them with one executemany per transaction.
+    # With rollup_seconds set, rollups are not recomputed on every flush: the touched timestamps
+    # are collected and the buckets are refreshed (cascading from the finest table) at most that often.
+    # `lock` only guards the buffers; SQLite is written under `write_lock`, so add() never waits
+    # for a slow or locked database.
+    def __init__(self, db_name=DB_NAME, max_rows=FLUSH_ROWS, max_seconds=FLUSH_SECONDS,
+                 rollup_seconds=None):
+        self.db_name = db_name
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.rollup_seconds = rollup_seconds
+        self.buffer = []
+        self.ping_buffer = []
+        self.dirty = set()
+        self.last_flush = time.monotonic()
+        self.last_rollup = time.monotonic()
+        self.lock = threading.RLock()
+        self.write_lock = threading.RLock()
+
+    def add(self, row, pings=()):
+        with self.lock:
+            self.buffer.append(row)
+            self.ping_buffer.extend(pings)
+            due = (len(self.buffer) >= self.max_rows
+                   or time.monotonic() - self.last_flush >= self.max_seconds)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                rows, self.buffer = self.buffer, []
+                pings, self.ping_buffer = self.ping_buffer, []
+                self.last_flush = time.monotonic()
+            deferred = self.rollup_seconds is not None
+            if rows or pings:
+                # timings recorded since the last flush go out in the same transaction
+                spans = [(ts, "collector", stage, ms) for ts, stage, ms in perf.drain()]
+                conn = db.connect(self.db_name)
                 try:
-                    return float(parts[1].split()[0])
-                except ValueError:
-                    return -1
-    return -1
-    
-def insert_log(data):
-    # TODO: Insert one row of system info into SQLite
-    pass
+                    with perf.span("collect.insert"):
+                        if shards.enabled():
+                            # raw rows go to the per-day shard files; shards opens the transactions
+                            shards.insert_samples(conn, rows, pings, spans, rollups=not deferred)
+                        else:
+                            with conn:  # one transaction: commit on success, rollback on error
+                                schema.insert_samples(conn, rows, pings, spans, rollups=not deferred)
+                except Exception:
+                    # keep the samples so the next flush can retry them (and nothing is lost silently)
+                    with self.lock:
+                        self.buffer[:0] = rows
+                        self.ping_buffer[:0] = pings
+                    raise
+                finally:
+                    conn.close()
+                if deferred:
+                    self.dirty.update(row[0] for row in rows)
+            if deferred and time.monotonic() - self.last_rollup >= self.rollup_seconds:
+                self.flush_rollups()
+
+    def flush_rollups(self):
+        with self.write_lock:
+            self.last_rollup = time.monotonic()
+            if not self.dirty:
+                return
+            conn = db.connect(self.db_name)
+            try:
+                with perf.span("collect.rollup"):
+                    if shards.enabled():
+                        shards.update_rollups(conn, self.dirty, cascade=True)
+                    else:
+                        with conn:
+                            schema.update_rollups(conn, self.dirty, cascade=True)
+                self.dirty.clear()
+            finally:
+                conn.close()
+
+class HttpPusher:
+    # Agent mode: same add/flush interface as LogWriter, but batches are POSTed to ingester.py
+    def __init__(self, url, max_rows=PUSH_ROWS, max_seconds=FLUSH_SECONDS):
+        self.url = url
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.buffer = []
+        self.ping_buffer = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.RLock()
+
+    def add(self, row, pings=()):
+        with self.lock:
+            self.buffer.append(row)
+            self.ping_buffer.extend(pings)
+            if (len(self.buffer) >= self.max_rows
+                    or time.monotonic() - self.last_flush >= self.max_seconds):
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.last_flush = time.monotonic()
+            if not self.buffer and not self.ping_buffer:
+                return
+            body = json.dumps({"rows": self.buffer, "pings": self.ping_buffer}).encode()
+            request = urllib.request.Request(
+                self.url, data=body, headers={"Content-Type": "application/json"}
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=PUSH_TIMEOUT):
+                    pass
+            except (urllib.error.URLError, OSError) as exc:
+                # keep sampling while the ingester is away; drop the oldest rows past MAX_BACKLOG
+                print("Push failed, will retry:", exc)
+                del self.buffer[:-MAX_BACKLOG]
+                del self.ping_buffer[:-MAX_BACKLOG * len(PROBE_TARGETS)]
+                return
+            self.buffer = []
+            self.ping_buffer = []
+
+writer = LogWriter()
+atexit.register(writer.flush)
+
+def handle_sigterm(signum, frame):
+    # sys.exit runs the atexit hooks, which flush the buffer
+    sys.exit(0)
+
+def run_compaction():
+    conn = db.connect(DB_NAME)
+    try:
+        for name, count in compact.compact(conn).items():
+            print(f"Compacted {name}: {count} rows")
+    finally:
+        conn.close()
+
+def run_retention():
+    conn = db.connect(DB_NAME)
+    try:
+        print("Retention:", retention.describe(retention.apply(conn)))
+    finally:
+        conn.close()
+
+def insert_log(data, pings=()):
+    writer.add(data, pings)
 
 def show_last_entries(limit=5):
-    # TODO: Retrieve and print the last few records from the database
-    pass
+    writer.flush()
+    conn = db.connect(DB_NAME)
+    try:
+        sql, params = schema.window_query(limit=limit)
+        _, rows = shards.read(conn, sql, params, limit=limit)
+    finally:
+        conn.close()
+    for row in reversed(rows):
+        print(row)
 
 if __name__ == "__main__":
-    init_db()
-    for _ in range(5):
-        row = get_system_info()
-        insert_log(row)
+    parser = argparse.ArgumentParser(description="Sample this machine into log.db")
+    parser.add_argument("--agent", metavar="URL",
+                        help="push samples to ingester.py (http://host:8765/ingest) instead")
+    parser.add_argument("--count", type=int, default=5, help="number of samples, 0 = run forever")
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    if args.agent:
+        writer = HttpPusher(args.agent)
+        atexit.register(writer.flush)
+    else:
+        init_db()
+    if psutil is None:
+        sys.exit("psutil is required to collect samples: pip install psutil")
+    psutil.cpu_percent(interval=None)  # prime the counter; the first real sample is a delta from here
+
+    next_compaction = time.monotonic()
+    next_retention = time.monotonic()
+
+    def collect_once():
+        global next_compaction, next_retention
+        row, pings = collect_sample()
+        insert_log(row, pings)
         print("Logged:", row)
-        time.sleep(10)
-    show_last_entries()
+        if not args.agent and compact.available() and time.monotonic() >= next_compaction:
+            next_compaction = time.monotonic() + COMPACT_SECONDS
+            maintenance_pool.submit(run_compaction)
+        # expired rows are deleted in small transactions on the maintenance thread, never inline
+        if not args.agent and time.monotonic() >= next_retention:
+            next_retention = time.monotonic() + RETENTION_SECONDS
+            maintenance_pool.submit(run_retention)
+
+    run_every(SAMPLE_SECONDS, collect_once, count=args.count or None)
+    if args.agent:
+        writer.flush()
+    else:
+        show_last_entries()
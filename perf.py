@@ -0,0 +1,55 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import schema
+
+# 每個 process 各自保留最近 RING_SIZE 筆計時（儀表板 / collector 各一份）
+RING_SIZE = 5000
+
+# (開始時間 epoch 毫秒, 階段名稱, 花了幾毫秒)；deque 的 append / popleft 本身是 thread-safe
+spans = deque(maxlen=RING_SIZE)
+
+
+@contextmanager
+def span(stage: str):
+    """with perf.span("query"): ...  量這一段花了多久，記進 ring buffer"""
+    started = schema.now_ms()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((started, stage, (time.perf_counter() - start) * 1000))
+
+
+def snapshot():
+    """目前 ring buffer 裡的所有計時（舊的在前）"""
+    return list(spans)
+
+
+def drain():
+    """取出並清掉目前的計時（collector 寫進 perf_log 用）"""
+    drained = []
+    while True:
+        try:
+            drained.append(spans.popleft())
+        except IndexError:
+            return drained
+
+
+def summary(records):
+    """依階段彙總：[{stage, count, p50_ms, p95_ms, max_ms}]，依 p95 由大到小"""
+    by_stage = {}
+    for _, stage, ms in records:
+        by_stage.setdefault(stage, []).append(ms)
+    rows = [
+        {
+            "stage": stage,
+            "count": len(values),
+            "p50_ms": schema.percentile(values, 0.5),
+            "p95_ms": schema.percentile(values, 0.95),
+            "max_ms": max(values),
+        }
+        for stage, values in by_stage.items()
+    ]
+    return sorted(rows, key=lambda row: row["p95_ms"], reverse=True)
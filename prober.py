@@ -0,0 +1,91 @@
+import asyncio
+import platform
+import time
+
+# 目標寫成 "host" 用 ICMP ping（非同步子行程），寫成 "host:port" 用 TCP connect（不開行程）
+PROBE_TIMEOUT = 2
+MAX_CONCURRENCY = 256
+IS_WINDOWS = platform.system().lower() == "windows"
+
+
+def parse_ping_time(output):
+    for line in output.splitlines():
+        if "time=" in line:
+            parts = line.split("time=")
+            if len(parts) > 1:
+                try:
+                    return float(parts[1].split()[0])
+                except ValueError:
+                    return -1
+    return -1
+
+
+def split_target(target):
+    """"8.8.8.8" -> ("8.8.8.8", None)；"8.8.8.8:53" -> ("8.8.8.8", 53)"""
+    host, sep, port = target.rpartition(":")
+    # 沒有中括號的 IPv6 位址（::1）本身就有冒號，不能當成 port
+    if sep and port.isdigit() and (":" not in host or host.startswith("[")):
+        return host.strip("[]"), int(port)
+    return target.strip("[]"), None
+
+
+async def icmp_probe(host, timeout=PROBE_TIMEOUT):
+    if IS_WINDOWS:
+        cmd = ["ping", "-n", "1", "-w", str(int(timeout * 1000)), host]
+    else:
+        cmd = ["ping", "-c", "1", "-W", str(max(int(timeout), 1)), host]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return ("DOWN", -1)
+    if proc.returncode != 0:
+        return ("DOWN", -1)
+    return ("UP", parse_ping_time(stdout.decode(errors="replace")))
+
+
+async def tcp_probe(host, port, timeout=PROBE_TIMEOUT):
+    start = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return ("DOWN", -1)
+    ms = (time.perf_counter() - start) * 1000
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return ("UP", round(ms, 3))
+
+
+async def probe(target, timeout=PROBE_TIMEOUT):
+    host, port = split_target(target)
+    try:
+        if port is None:
+            return await icmp_probe(host, timeout)
+        return await tcp_probe(host, port, timeout)
+    except OSError:
+        # ping 不存在、行程開不起來等等，都當成 DOWN
+        return ("DOWN", -1)
+
+
+async def probe_all(targets, timeout=PROBE_TIMEOUT, concurrency=MAX_CONCURRENCY):
+    """同時探測所有目標，每個目標各自逾時；回傳 [(target, status, ms), ...]，順序同 targets"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(target):
+        async with semaphore:
+            return await probe(target, timeout)
+
+    results = await asyncio.gather(*(limited(t) for t in targets))
+    return [(target, status, ms) for target, (status, ms) in zip(targets, results)]
+
+
+def run_probes(targets, timeout=PROBE_TIMEOUT):
+    """給同步程式（collector 的 thread pool）呼叫的入口"""
+    return asyncio.run(probe_all(targets, timeout))
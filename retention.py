@@ -0,0 +1,132 @@
+import os
+import time
+
+import compact
+import db
+import perf
+import schema
+import shards
+
+# 每張表保留多久（秒），超過的由 collector 的背景工作分批刪掉
+# 環境變數 LOG_RETENTION 可以覆蓋個別的表，例如 "system_log=72h,system_log_1m=14d"
+MINUTE, HOUR, DAY = 60, 3600, 86400
+RULES = {
+    schema.TABLE: 48 * HOUR,
+    schema.PING_TABLE: 48 * HOUR,
+    schema.PERF_TABLE: 7 * DAY,
+    "system_log_1m": 30 * DAY,
+    "system_log_5m": 90 * DAY,
+    "system_log_1h": 365 * DAY,
+}
+# 判斷時間用的欄位（彙總表是 bucket，其他是 timestamp）
+TIME_COLUMNS = {table: "bucket" for table in schema.ROLLUPS}
+
+# 每個交易最多刪幾筆：寫入端最多只會被擋這一小段，兩批之間再讓出一下
+BATCH_ROWS = 2000
+BATCH_PAUSE = 0.05
+
+UNITS = {"m": MINUTE, "h": HOUR, "d": DAY}
+
+
+def parse_duration(text: str) -> int:
+    """"48h" -> 172800，"30d"、"15m" 同理，純數字是秒"""
+    text = text.strip().lower()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def load_rules(text=None):
+    """預設規則加上 LOG_RETENTION（"表=長度,..."）的覆蓋"""
+    text = os.environ.get("LOG_RETENTION", "") if text is None else text
+    rules = dict(RULES)
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        table, _, duration = item.partition("=")
+        table = table.strip()
+        if table not in RULES:
+            raise ValueError(f"unknown table in LOG_RETENTION: {table}")
+        rules[table] = parse_duration(duration)
+    return rules
+
+
+def purge(conn, table, cutoff, batch_rows=BATCH_ROWS, pause=BATCH_PAUSE):
+    """刪掉 table 裡時間早於 cutoff（epoch 毫秒）的資料，每批一個小交易；回傳刪掉幾筆
+
+    每一批都走時間欄的索引（彙總表的 bucket 就是 rowid），只碰到過期的那一段。
+    """
+    column = TIME_COLUMNS.get(table, "timestamp")
+    reclaimed = 0
+    while True:
+        with conn:
+            deleted = conn.execute(
+                f"DELETE FROM {table} WHERE rowid IN ("
+                f"SELECT rowid FROM {table} WHERE {column} < ? LIMIT ?)",
+                (cutoff, batch_rows),
+            ).rowcount
+        reclaimed += deleted
+        if deleted < batch_rows:
+            return reclaimed
+        time.sleep(pause)
+
+
+def raw_cutoff(cutoff):
+    """原始資料實際能刪到哪裡：只刪已經寫成 Parquet 快照的日期，沒有快照就一筆都不刪
+
+    fleet 模式或沒裝 pyarrow 時，過了保留期限的原始資料也不能在還沒封存前就丟掉。
+    """
+    if not compact.available():
+        return None
+    boundary = compact.history_boundary()
+    if boundary is None:
+        return None
+    return min(cutoff, boundary)
+
+
+def apply(conn, rules=None, now=None, batch_rows=BATCH_ROWS, pause=BATCH_PAUSE):
+    """依規則刪掉所有過期的資料
+
+    原始資料（system_log）只刪到 Parquet 快照涵蓋的範圍（raw_cutoff），
+    刪之前先跑一次 compact，補送進來的舊資料併進快照之後才會被刪。
+    開了分片（LOG_SHARD_DIR）時，整天都過期的原始資料分片直接刪檔案。
+    回傳 {"reclaimed": {表: 筆數}, "dropped_shards": [日期, ...], "unarchived": bool, "seconds": 花了幾秒}，
+    unarchived 表示有過期的原始資料因為還沒封存而保留下來。
+    """
+    rules = load_rules() if rules is None else rules
+    now = schema.now_ms() if now is None else now
+    start = time.perf_counter()
+    report = {"reclaimed": {}, "dropped_shards": [], "unarchived": False}
+    with perf.span("retention"):
+        for table, seconds in rules.items():
+            cutoff = now - seconds * 1000
+            if table == schema.TABLE:
+                compact.compact(conn)
+                archived = raw_cutoff(cutoff)
+                report["unarchived"] = archived is None or archived < cutoff
+                if archived is None:
+                    continue
+                cutoff = archived
+                if shards.enabled():
+                    report["dropped_shards"] = shards.drop_before(cutoff // schema.DAY_MS)
+            report["reclaimed"][table] = purge(conn, table, cutoff, batch_rows, pause)
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def describe(report):
+    """一行摘要：刪了哪些表幾筆、刪了幾個分片、花了多久"""
+    parts = [f"{table} {rows}" for table, rows in report["reclaimed"].items() if rows]
+    if report["dropped_shards"]:
+        parts.append(f"{len(report['dropped_shards'])} shard file(s)")
+    reclaimed = ", ".join(parts) or "nothing"
+    kept = f" (kept expired {schema.TABLE} rows not yet archived to Parquet)" if report["unarchived"] else ""
+    return f"reclaimed {reclaimed} in {report['seconds']:.2f}s{kept}"
+
+
+if __name__ == "__main__":
+    conn = db.connect()
+    try:
+        print(describe(apply(conn)))
+    finally:
+        conn.close()
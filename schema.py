@@ -0,0 +1,461 @@
+import math
+import time
+from datetime import datetime, timezone
+
+# collector（main.py）和儀表板（app.py）共用的 log.db 結構與查詢
+# 結構有變動就把 SCHEMA_VERSION 加一，並在 migrate() 補上對應的步驟
+SCHEMA_VERSION = 8
+
+TABLE = "system_log"
+PING_TABLE = "ping_log"
+PERF_TABLE = "perf_log"  # collector 各步驟的計時（perf.span）
+HOSTS_TABLE = "hosts"  # 送過資料的主機與最後一次出現的時間（儀表板的主機選單）
+LEGACY_TABLE = "logs"  # Week 7 的舊表（Timestamp / CPU / Ping_Status ...）
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"  # v1 以前 timestamp 存的文字格式（本地時間）
+
+# 欄位名稱 -> SQLite 型別（id 是 INTEGER PRIMARY KEY，另外定義）
+# timestamp 一律是 UTC epoch 毫秒（INTEGER），範圍查詢就是整數比較
+COLUMNS = {
+    "timestamp": "INTEGER NOT NULL",
+    "cpu": "REAL",
+    "memory": "REAL",
+    "disk": "REAL",
+    "ping_status": "TEXT",
+    "ping_ms": "REAL",
+    "host": "TEXT",  # 哪一台機器的樣本（v4 起；更早的資料是 NULL）
+}
+PING_COLUMNS = {
+    "timestamp": "INTEGER NOT NULL",
+    "host": "TEXT",
+    "status": "TEXT",
+    "ms": "REAL",
+}
+PERF_COLUMNS = {
+    "timestamp": "INTEGER NOT NULL",
+    "source": "TEXT",
+    "stage": "TEXT",
+    "ms": "REAL",
+}
+METRICS = ("cpu", "memory", "disk", "ping_ms")
+
+# 彙總表（由粗到細）：表名 -> 每一桶幾秒
+ROLLUPS = {
+    "system_log_1h": 3600,
+    "system_log_5m": 300,
+    "system_log_1m": 60,
+}
+ROLLUP_AGGS = ("min", "max", "avg", "p95")
+
+
+def _covering(keys, columns):
+    # 先放查詢條件用的欄位，後面接上查詢會讀的欄位：那個查詢只讀索引、不用回頭查資料表
+    return f"{TABLE}({', '.join(list(keys) + [col for col in columns if col not in keys])})"
+
+
+# 最新一筆（latest_query）和圖表數值（series_query）讀的欄位
+LATEST_COLUMNS = ("timestamp", "cpu", "memory", "disk")
+SERIES_COLUMNS = LATEST_COLUMNS + ("ping_status", "ping_ms")
+
+# 索引名稱 -> 建在哪些欄位上
+# system_log 的時間索引和主機索引只多帶熱門查詢要讀的欄位（v7 起）：時間索引涵蓋
+# series_query、latest_query 和重算彙總桶，主機索引涵蓋單一主機的 latest_query。
+# 其他查詢（整列的 window_query）走索引找到範圍再回頭讀資料表，不必每個索引都複製整列
+INDEXES = {
+    "idx_system_log_timestamp": _covering(("timestamp",), SERIES_COLUMNS),
+    "idx_system_log_ping_status": f"{TABLE}(ping_status, timestamp)",
+    "idx_system_log_host": _covering(("host", "timestamp"), LATEST_COLUMNS),
+    "idx_system_log_cpu": f"{TABLE}(cpu, timestamp)",  # v8：沒有時間範圍、只有 CPU 門檻的查詢
+    "idx_ping_log_host": f"{PING_TABLE}(host, timestamp)",
+    "idx_ping_log_timestamp": f"{PING_TABLE}(timestamp)",  # v5：retention 依時間分批刪
+    "idx_perf_log_timestamp": f"{PERF_TABLE}(timestamp, source, stage, ms)",
+}
+# 定義改過的索引 -> 在哪一版改的：比它舊的資料庫要先刪掉舊定義，create_tables 才會照新的重建
+REBUILT_INDEXES = {
+    "idx_system_log_timestamp": 7,
+    "idx_system_log_ping_status": 7,
+    "idx_system_log_host": 7,
+    "idx_perf_log_timestamp": 6,
+}
+
+# 筆數有上限的小表：整表掃描沒關係（查詢計畫檢查不算它們）
+SMALL_TABLES = (*ROLLUPS, HOSTS_TABLE)
+
+SELECT_COLUMNS = ", ".join(COLUMNS)
+
+
+def insert_sql(table=TABLE):
+    return f"INSERT INTO {table} ({SELECT_COLUMNS}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+
+INSERT_SQL = insert_sql()
+PING_INSERT_SQL = (
+    f"INSERT INTO {PING_TABLE} ({', '.join(PING_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(PING_COLUMNS))})"
+)
+PERF_INSERT_SQL = (
+    f"INSERT INTO {PERF_TABLE} ({', '.join(PERF_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(PERF_COLUMNS))})"
+)
+HOSTS_UPSERT_SQL = (
+    f"INSERT INTO {HOSTS_TABLE} (host, last_seen) VALUES (?, ?) "
+    "ON CONFLICT(host) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)"
+)
+
+
+# ---------- 時間 ----------
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def to_epoch_ms(dt: datetime):
+    """datetime（沒有時區就當本地時間）轉成 epoch 毫秒"""
+    return int(dt.timestamp() * 1000)
+
+
+# Parquet 快照和分片都以 UTC 的一天為單位，day 是 epoch 起算的第幾天
+DAY_MS = 86_400_000
+DAY_FORMAT = "%Y-%m-%d"
+
+
+def day_name(day: int):
+    """第幾天 -> "2026-10-16"（UTC）"""
+    return datetime.fromtimestamp(day * DAY_MS / 1000, timezone.utc).strftime(DAY_FORMAT)
+
+
+def day_number(name: str):
+    """"2026-10-16" -> 第幾天（day_name 的反向）"""
+    return to_epoch_ms(datetime.strptime(name, DAY_FORMAT).replace(tzinfo=timezone.utc)) // DAY_MS
+
+
+# v1 的文字時間（本地時間）在 SQLite 裡直接換成 UTC epoch 毫秒
+TEXT_TO_MS = "CAST(strftime('%s', {col}, 'utc') AS INTEGER) * 1000"
+
+
+# ---------- 建表 / 遷移 ----------
+def _create_table(conn, name, columns):
+    body = ",\n".join(f"{col} {sql_type}" for col, sql_type in columns.items())
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            {body}
+        )
+    """)
+
+
+def create_log_table(conn, database="main"):
+    """建 system_log 和它的索引；database 可以是 ATTACH 進來的分片（shards.py）"""
+    _create_table(conn, f"{database}.{TABLE}", COLUMNS)
+    for name, target in INDEXES.items():
+        if target.startswith(f"{TABLE}("):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {database}.{name} ON {target}")
+
+
+def create_tables(conn):
+    create_log_table(conn)
+    _create_table(conn, PING_TABLE, PING_COLUMNS)
+    _create_table(conn, PERF_TABLE, PERF_COLUMNS)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {HOSTS_TABLE} (
+            host TEXT PRIMARY KEY,
+            last_seen INTEGER
+        )
+    """)
+
+    metric_columns = ",\n".join(f"{m}_{agg} REAL" for m in METRICS for agg in ROLLUP_AGGS)
+    for table in ROLLUPS:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket INTEGER PRIMARY KEY,
+                samples INTEGER,
+                {metric_columns},
+                up_count INTEGER,
+                down_count INTEGER
+            )
+        """)
+
+    for name, target in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+
+def _import_legacy_logs(conn):
+    """把舊的 logs 表（欄位大小寫不同、文字時間）搬進 system_log，已經有的時間點不重複搬"""
+    legacy = {row[1].lower(): row[1] for row in conn.execute(f"PRAGMA table_info({LEGACY_TABLE})")}
+    if "timestamp" not in legacy:
+        return
+    ts = TEXT_TO_MS.format(col=legacy["timestamp"])
+    source = ", ".join(
+        ts if col == "timestamp" else legacy.get(col, "NULL") for col in COLUMNS
+    )
+    conn.execute(
+        f"INSERT INTO {TABLE} ({SELECT_COLUMNS}) "
+        f"SELECT {source} FROM {LEGACY_TABLE} "
+        f"WHERE {ts} NOT IN (SELECT timestamp FROM {TABLE}) "
+        f"ORDER BY {legacy['timestamp']}"
+    )
+
+
+def _column_type(conn, table, column):
+    for row in conn.execute(f"PRAGMA table_info({table})"):
+        if row[1] == column:
+            return row[2].upper()
+    return None
+
+
+def _convert_text_timestamps(conn):
+    """v1 → v2：system_log / ping_log 的文字時間改成 epoch 毫秒（重建資料表，id 不變）"""
+    for table, columns in ((TABLE, COLUMNS), (PING_TABLE, PING_COLUMNS)):
+        if _column_type(conn, table, "timestamp") != "TEXT":
+            continue
+        old = f"{table}_v1"
+        conn.execute(f"ALTER TABLE {table} RENAME TO {old}")
+        _create_table(conn, table, columns)
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({old})")}
+        source = ", ".join(
+            TEXT_TO_MS.format(col="timestamp") if col == "timestamp"
+            else col if col in existing else "NULL"
+            for col in columns
+        )
+        conn.execute(
+            f"INSERT INTO {table} (id, {', '.join(columns)}) SELECT id, {source} FROM {old}"
+        )
+        # 舊表的索引會跟著一起刪掉，之後 create_tables 會在新表上重建
+        conn.execute(f"DROP TABLE {old}")
+
+    # 彙總表的 bucket 也改成毫秒：直接丟掉，等一下從原始資料重算
+    for table in ROLLUPS:
+        if _column_type(conn, table, "bucket") == "TEXT":
+            conn.execute(f"DROP TABLE {table}")
+
+
+def _add_host_column(conn):
+    """v3 → v4：system_log 加上 host 欄（舊資料是 NULL）"""
+    # 全新的 log.db 還沒有 system_log，等一下 create_tables 直接建新版的
+    if _column_type(conn, TABLE, "timestamp") and _column_type(conn, TABLE, "host") is None:
+        conn.execute(f"ALTER TABLE {TABLE} ADD COLUMN host {COLUMNS['host']}")
+
+
+def rebuild_rollups(conn):
+    """從原始資料重算所有彙總表"""
+    timestamps = [row[0] for row in conn.execute(f"SELECT DISTINCT timestamp FROM {TABLE}")]
+    update_rollups(conn, timestamps)
+
+
+def migrate(conn):
+    """把 log.db 升到 SCHEMA_VERSION（用 PRAGMA user_version 記錄目前版本）"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    with conn:
+        conn.execute("BEGIN")  # 建表、搬資料包在同一個交易裡，失敗就整個還原
+        if version < 2:
+            _convert_text_timestamps(conn)
+        if version < 4:
+            _add_host_column(conn)
+        for name, changed in REBUILT_INDEXES.items():
+            if version < changed:
+                conn.execute(f"DROP INDEX IF EXISTS {name}")
+        create_tables(conn)  # 新版本加的表 / 索引（例如 v3 的 perf_log、v5 的 ping_log 時間索引）都在這裡建
+        if version < 1:
+            _import_legacy_logs(conn)
+        if version < 2:
+            rebuild_rollups(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+# ---------- 寫入 ----------
+def bucket_start(ts, seconds):
+    return ts - ts % (seconds * 1000)
+
+
+def percentile(values, q):
+    # nearest-rank percentile
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+def _rollup_from_raw(conn, table, seconds, starts):
+    for start in starts:
+        rows = conn.execute(
+            f"SELECT cpu, memory, disk, ping_ms, ping_status FROM {TABLE} "
+            "WHERE timestamp >= ? AND timestamp < ?",
+            (start, start + seconds * 1000),
+        ).fetchall()
+        if not rows:
+            continue
+
+        values = [len(rows)]
+        for i, metric in enumerate(METRICS):
+            column = [r[i] for r in rows if r[i] is not None]
+            if metric == "ping_ms":
+                column = [v for v in column if v >= 0]  # -1 means DOWN, not a latency
+            values += [
+                min(column, default=None),
+                max(column, default=None),
+                sum(column) / len(column) if column else None,
+                percentile(column, 0.95),
+            ]
+        values.append(sum(1 for r in rows if r[4] == "UP"))
+        values.append(sum(1 for r in rows if r[4] == "DOWN"))
+
+        placeholders = ", ".join("?" * (len(values) + 1))
+        conn.execute(
+            f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})",
+            [start] + values,
+        )
+
+
+# 由細的彙總桶合成粗的：平均值依樣本數加權，p95 取各小桶 p95 的最大值（上界）
+MERGE_AGGS = {
+    "min": "MIN({col})",
+    "max": "MAX({col})",
+    "avg": "SUM({col} * samples) / SUM(CASE WHEN {col} IS NOT NULL THEN samples END)",
+    "p95": "MAX({col})",
+}
+
+
+def _rollup_from_rollup(conn, table, seconds, source, starts):
+    merged = ", ".join(
+        MERGE_AGGS[agg].format(col=f"{m}_{agg}") for m in METRICS for agg in ROLLUP_AGGS
+    )
+    for start in starts:
+        # 沒有任何小桶時聚合結果是一列 NULL，外層把它濾掉
+        conn.execute(
+            f"INSERT OR REPLACE INTO {table} SELECT * FROM ("
+            f"SELECT ? AS bucket, SUM(samples) AS samples, {merged}, SUM(up_count), SUM(down_count) "
+            f"FROM {source} WHERE bucket >= ? AND bucket < ?"
+            ") WHERE samples IS NOT NULL",
+            (start, start, start + seconds * 1000),
+        )
+
+
+def update_rollups(conn, timestamps, cascade=False):
+    # Recompute every rollup bucket touched by the given timestamps from the raw rows.
+    # With cascade=True only the finest table reads raw rows and each coarser table is merged
+    # from the next finer one, so a busy hour bucket is not re-read on every batch (fleet ingest).
+    source = None
+    for table, seconds in reversed(ROLLUPS.items()):
+        starts = {bucket_start(ts, seconds) for ts in timestamps}
+        if source is None or not cascade:
+            _rollup_from_raw(conn, table, seconds, starts)
+        else:
+            _rollup_from_rollup(conn, table, seconds, source, starts)
+        source = table
+
+
+def insert_samples(conn, rows, pings=(), spans=(), rollups=True, route=None):
+    """寫入一批樣本、ping 結果與計時，並更新受影響的彙總桶（交易由呼叫端控制）
+
+    rollups=False 時不更新彙總表，由呼叫端之後再對這些時間點呼叫 update_rollups。
+    route(timestamp) 有給時，每一筆樣本寫進它回傳的表（分片的 shard_N.system_log）。
+    """
+    if route is None:
+        conn.executemany(INSERT_SQL, rows)
+    else:
+        by_table = {}
+        for row in rows:
+            by_table.setdefault(route(row[0]), []).append(row)
+        for table, group in by_table.items():
+            conn.executemany(insert_sql(table), group)
+    conn.executemany(PING_INSERT_SQL, pings)
+    conn.executemany(PERF_INSERT_SQL, spans)
+
+    last_seen = {}
+    for row in rows:
+        host = row[-1]
+        if host is not None and row[0] > last_seen.get(host, -1):
+            last_seen[host] = row[0]
+    conn.executemany(HOSTS_UPSERT_SQL, last_seen.items())
+
+    if rollups:
+        update_rollups(conn, [row[0] for row in rows])
+
+
+# ---------- 查詢 ----------
+def where_clause(bounds=None, ping_status=None, cpu_min=None, host=None):
+    """把時間範圍與過濾條件組成參數化的 WHERE 子句，回傳 (sql, params)"""
+    clauses, params = [], []
+    if host is not None:
+        clauses.append("host = ?")
+        params.append(host)
+    if bounds is not None:
+        clauses.append("timestamp BETWEEN ? AND ?")
+        params.extend(bounds)
+    if ping_status is not None:
+        clauses.append("ping_status = ?")
+        params.append(ping_status)
+    if cpu_min is not None:
+        clauses.append("cpu >= ?")
+        params.append(cpu_min)
+    if not clauses:
+        return "", []
+    return "WHERE " + " AND ".join(clauses), params
+
+
+def window_query(bounds=None, ping_status=None, cpu_min=None, limit=None, host=None):
+    """選取區間（可加過濾）的原始資料；limit 有值時只取最新的 limit 筆（新的在前）"""
+    where, params = where_clause(bounds, ping_status, cpu_min, host)
+    if limit is None:
+        # 只有 CPU 門檻時，ORDER BY timestamp 會讓 SQLite 沿著時間索引掃完整張表；
+        # +timestamp 讓排序用不到索引，改走 cpu 索引只讀超過門檻的列再排序
+        only_cpu = cpu_min is not None and bounds is None and ping_status is None and host is None
+        order = "+timestamp" if only_cpu else "timestamp"
+        return f"SELECT {SELECT_COLUMNS} FROM {TABLE} {where} ORDER BY {order}", params
+    return (
+        f"SELECT {SELECT_COLUMNS} FROM {TABLE} {where} ORDER BY timestamp DESC LIMIT ?",
+        params + [limit],
+    )
+
+
+def tail_query():
+    """id 在 (下限, 上限) 之間、且時間不早於某值的資料列（增量讀取用），第一欄是 id"""
+    return (
+        f"SELECT id, {SELECT_COLUMNS} FROM {TABLE} "
+        "WHERE id > ? AND id < ? AND timestamp >= ? ORDER BY id"
+    )
+
+
+def latest_query(host=None, count=2):
+    """最新的 count 筆指標（新的在前）：沿著時間索引倒著讀幾筆就停，跟總筆數無關"""
+    where, params = where_clause(host=host)
+    return (
+        f"SELECT timestamp, cpu, memory, disk FROM {TABLE} {where} "
+        "ORDER BY timestamp DESC LIMIT ?",
+        params + [count],
+    )
+
+
+def series_query(bounds):
+    """圖表用的數值欄（up 是 ping_status = 'UP' 的 0/1）"""
+    return (
+        f"SELECT timestamp, cpu, memory, disk, ping_ms, ping_status = 'UP' AS up "
+        f"FROM {TABLE} WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp",
+        list(bounds),
+    )
+
+
+def rollup_query(table, bounds=None):
+    """彙總表每一桶的平均值與 UP/DOWN 次數"""
+    where, params = "", []
+    if bounds is not None:
+        where, params = "WHERE bucket BETWEEN ? AND ?", list(bounds)
+    return (
+        f"SELECT bucket, samples, cpu_avg AS cpu, memory_avg AS memory, disk_avg AS disk, "
+        f"up_count, down_count FROM {table} {where} ORDER BY bucket",
+        params,
+    )
+
+
+def perf_query(since_ms: int):
+    """某個時間點之後 collector 記下的計時（perf_log）"""
+    return (
+        f"SELECT timestamp, source, stage, ms FROM {PERF_TABLE} "
+        "WHERE timestamp >= ? ORDER BY timestamp",
+        [since_ms],
+    )
+
+
+def hosts_query():
+    """送過資料的主機（由 insert_samples 維護的 hosts 表）"""
+    return f"SELECT host FROM {HOSTS_TABLE} ORDER BY host", []
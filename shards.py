@@ -0,0 +1,244 @@
+import argparse
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import db
+import schema
+
+# 選用：設了 LOG_SHARD_DIR 時，system_log 的原始資料改成每天（UTC）一個 SQLite 檔：
+#   $LOG_SHARD_DIR/system_log-2026-10-16.db
+# 彙總表、ping_log、perf_log、hosts 還是留在 log.db。查詢時只 ATTACH 時間範圍重疊的那幾天，
+# 丟掉舊資料就是刪檔案，不用對一張大表跑 DELETE / VACUUM。
+SHARD_DIR = os.environ.get("LOG_SHARD_DIR") or None
+PREFIX = f"{schema.TABLE}-"
+SUFFIX = ".db"
+# 每個分片的 id 從「第幾天 × SHARD_ID_SPAN」開始編：跨分片不會重複，而且跟著日期遞增。
+# 補送的舊資料寫進較早的分片時 id 比新的分片小，整體的 MAX(id) 不會變：
+# 儀表板的增量讀取要逐個來源記位置（watermarks / id_range）
+SHARD_ID_SPAN = 10 ** 9
+MAX_ID = 2 ** 63 - 1
+
+ROW_COLUMNS = f"id, {schema.SELECT_COLUMNS}"
+
+
+def enabled():
+    return SHARD_DIR is not None
+
+
+def shard_path(day: int):
+    return os.path.join(SHARD_DIR, f"{PREFIX}{schema.day_name(day)}{SUFFIX}")
+
+
+def shard_days():
+    """已經有分片檔的日期（epoch 天數），由小到大"""
+    if not enabled() or not os.path.isdir(SHARD_DIR):
+        return []
+    days = []
+    for name in os.listdir(SHARD_DIR):
+        if name.startswith(PREFIX) and name.endswith(SUFFIX):
+            days.append(schema.day_number(name[len(PREFIX):-len(SUFFIX)]))
+    return sorted(days)
+
+
+def days_for(bounds=None):
+    """跟 (開始, 結束) epoch 毫秒重疊的分片；None 表示全部"""
+    days = shard_days()
+    if bounds is None:
+        return days
+    first, last = bounds[0] // schema.DAY_MS, bounds[1] // schema.DAY_MS
+    return [day for day in days if first <= day <= last]
+
+
+def batches(conn, days, size=None):
+    """一條連線能 ATTACH 的數量有上限（預設 10），分片多的時候分批查"""
+    size = size or conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    return [days[i:i + size] for i in range(0, len(days), size)] or [[]]
+
+
+def _init_shard(conn, alias, day):
+    # 新的分片：WAL、建表和索引，再把 id 的起點設成這一天的區段
+    conn.execute(f"PRAGMA {alias}.journal_mode = {db.PRAGMAS['journal_mode']}")
+    conn.execute(f"PRAGMA {alias}.synchronous = {db.PRAGMAS['synchronous']}")
+    with conn:
+        schema.create_log_table(conn, alias)
+        conn.execute(
+            f"INSERT INTO {alias}.sqlite_sequence (name, seq) SELECT ?, ? "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {alias}.sqlite_sequence WHERE name = ?)",
+            (schema.TABLE, day * SHARD_ID_SPAN, schema.TABLE),
+        )
+
+
+@contextmanager
+def attached(conn, days, create=False, main=True):
+    """ATTACH 這幾天的分片，再建一個叫 system_log 的 TEMP VIEW 把它們 UNION ALL 起來
+
+    TEMP VIEW 會蓋過 main.system_log，schema 裡現成的查詢不用改就只查這幾天。
+    main=True 時 view 也包含 log.db 裡原本的 system_log（開分片之前寫的資料）。
+    create=False 時沒有檔案的日期直接略過；yield 的 route(timestamp) 回傳那一筆要寫進的表。
+    ATTACH / DETACH 不能在交易裡做，交易要開在這個 with 裡面。
+    """
+    aliases = {}
+    try:
+        for day in days:
+            path = shard_path(day)
+            if create:
+                os.makedirs(SHARD_DIR, exist_ok=True)
+            elif not os.path.exists(path):
+                continue
+            alias = f"shard_{len(aliases)}"
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+            aliases[day] = alias
+            if create:
+                _init_shard(conn, alias, day)
+
+        sources = ([f"main.{schema.TABLE}"] if main else []) + [
+            f"{alias}.{schema.TABLE}" for alias in aliases.values()
+        ]
+        if sources:
+            conn.execute(
+                f"CREATE TEMP VIEW {schema.TABLE} AS "
+                + " UNION ALL ".join(f"SELECT {ROW_COLUMNS} FROM {source}" for source in sources)
+            )
+        yield lambda ts: f"{aliases[ts // schema.DAY_MS]}.{schema.TABLE}"
+    finally:
+        conn.execute(f"DROP VIEW IF EXISTS temp.{schema.TABLE}")
+        for alias in aliases.values():
+            conn.execute(f"DETACH DATABASE {alias}")
+
+
+def read(conn, sql, params=(), bounds=None, limit=None):
+    """在時間範圍重疊的分片上跑同一個查詢，回傳 (欄位名稱, 資料列)
+
+    分片比能 ATTACH 的數量多時分批跑、依日期接起來，照時間（或 id）排序的查詢接起來仍然有序。
+    limit 有值表示查詢是「最新的 limit 筆」（ORDER BY timestamp DESC LIMIT），
+    從最新的一天往回一天一天查，湊滿就停。沒開分片時就是直接在 conn 上跑。
+    """
+    if not enabled():
+        cursor = conn.execute(sql, params)
+        return [d[0] for d in cursor.description], cursor.fetchall()
+
+    days = days_for(bounds)
+    if limit is None:
+        # log.db 裡開分片之前的資料最舊，跟第一批一起查
+        groups = [(group, i == 0) for i, group in enumerate(batches(conn, days))]
+    else:
+        groups = [([day], False) for day in reversed(days)] + [([], True)]
+
+    columns, rows = None, []
+    for group, main in groups:
+        with attached(conn, group, main=main):
+            cursor = conn.execute(sql, params)
+            columns = [d[0] for d in cursor.description]
+            rows += cursor.fetchall()
+        if limit is not None and len(rows) >= limit:
+            break
+    return columns, rows if limit is None else rows[:limit]
+
+
+def id_range(source):
+    """某個來源的 id 區間 (下限, 上限)，兩端都不含
+
+    source 是分片的日期；None 是 log.db 本身的 system_log（開分片時它的 id 在所有分片的區段之前）。
+    """
+    if source is None:
+        return 0, SHARD_ID_SPAN if enabled() else MAX_ID
+    return source * SHARD_ID_SPAN, (source + 1) * SHARD_ID_SPAN
+
+
+def source_of(row_id: int):
+    """某個 id 屬於哪個來源（id_range 的反向）"""
+    return (row_id // SHARD_ID_SPAN or None) if enabled() else None
+
+
+def watermarks(conn):
+    """每個來源目前的 MAX(id)：{None: log.db 本身, 日期: 那一天的分片}；空的來源是區間下限"""
+    marks = {None: conn.execute(f"SELECT MAX(id) FROM main.{schema.TABLE}").fetchone()[0] or 0}
+    for group in batches(conn, shard_days()):
+        with attached(conn, group, main=False) as route:
+            for day in group:
+                try:
+                    table = route(day * schema.DAY_MS)
+                except KeyError:  # 列出之後才被 drop_before 刪掉
+                    continue
+                top = conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0]
+                marks[day] = top or id_range(day)[0]
+    return marks
+
+
+def extent(conn, column):
+    """system_log 某一欄的 (MIN, MAX)：最小值只查最舊的分片、最大值只查最新的"""
+    sql = f"SELECT MIN({column}), MAX({column}) FROM {schema.TABLE}"
+    days = shard_days()
+    if not enabled() or not days:
+        return conn.execute(sql).fetchone()
+    with attached(conn, days[:1]):
+        first = conn.execute(sql).fetchone()[0]
+    with attached(conn, days[-1:]):
+        last = conn.execute(sql).fetchone()[1]
+    return first, last
+
+
+def insert_samples(conn, rows, pings=(), spans=(), rollups=True):
+    """schema.insert_samples 的分片版：樣本依日期寫進各自的分片（沒有就建）
+
+    交易由這裡開：每一批分片一個交易，ping / 計時 / hosts 跟第一批一起寫。
+    WAL 模式下跨檔案的 commit 不是原子的，但每個檔案各自的寫入仍然是。
+    """
+    days = sorted({row[0] // schema.DAY_MS for row in rows})
+    for i, group in enumerate(batches(conn, days)):
+        wanted = set(group)
+        with attached(conn, group, create=True) as route:
+            with conn:
+                schema.insert_samples(
+                    conn,
+                    [row for row in rows if row[0] // schema.DAY_MS in wanted],
+                    pings if i == 0 else (),
+                    spans if i == 0 else (),
+                    rollups,
+                    route=route,
+                )
+
+
+def update_rollups(conn, timestamps, cascade=False):
+    """schema.update_rollups 的分片版：依日期分批 ATTACH，從分片讀原始資料重算（交易由這裡開）"""
+    by_day = {}
+    for ts in timestamps:
+        by_day.setdefault(ts // schema.DAY_MS, []).append(ts)
+    for group in batches(conn, sorted(by_day)):
+        with attached(conn, group):
+            with conn:
+                schema.update_rollups(conn, [ts for day in group for ts in by_day[day]], cascade)
+
+
+def drop_before(day: int):
+    """刪掉 day 之前（不含）的分片檔，回傳刪掉的日期名稱
+
+    彙總表在 log.db 裡不受影響；正在讀這個檔案的連線會讀完手上的那一份。
+    """
+    dropped = []
+    for old in shard_days():
+        if old >= day:
+            break
+        path = shard_path(old)
+        for extra in ("-wal", "-shm"):
+            if os.path.exists(path + extra):
+                os.remove(path + extra)
+        os.remove(path)
+        dropped.append(schema.day_name(old))
+    return dropped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List or drop the per-day system_log shards")
+    parser.add_argument("--drop-before", metavar="YYYY-MM-DD",
+                        help="delete the shards of every day before this one (UTC)")
+    args = parser.parse_args()
+    if not enabled():
+        raise SystemExit("LOG_SHARD_DIR is not set")
+    if args.drop_before:
+        for name in drop_before(schema.day_number(args.drop_before)):
+            print(f"dropped {name}")
+    else:
+        for day in shard_days():
+            print(f"{schema.day_name(day)}: {os.path.getsize(shard_path(day))} bytes")
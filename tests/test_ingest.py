@@ -0,0 +1,59 @@
+"""ingester.parse_batch：型別不對的資料列整批退回（400），不會進寫入緩衝區"""
+import json
+
+import pytest
+
+import ingester
+
+ROW = [1_700_000_000_000, 12.5, 40.0, 55.0, "UP", 18.0, "web-1"]
+PING = [1_700_000_000_000, "8.8.8.8", "UP", 18.0]
+
+
+def body(**payload):
+    return json.dumps(payload).encode()
+
+
+def test_accepts_valid_batch():
+    rows, pings = ingester.parse_batch(body(rows=[ROW, ROW[:5] + [None, "web-2"]], pings=[PING]))
+    assert rows == [tuple(ROW), tuple(ROW[:5] + [None, "web-2"])]
+    assert pings == [tuple(PING)]
+    assert ingester.parse_batch(body()) == ([], [])
+
+
+@pytest.mark.parametrize("payload", [
+    b"[]",
+    b'"rows"',
+    b"not json",
+])
+def test_rejects_non_object_body(payload):
+    with pytest.raises(ValueError):
+        ingester.parse_batch(payload)
+
+
+@pytest.mark.parametrize("index, value", [
+    (0, "2026-10-01 10:00:00"),  # 時間戳記要是整數
+    (0, 1.7e12),
+    (0, None),
+    (0, True),                   # bool 不算數字
+    (1, "12.5"),
+    (1, False),
+    (4, 1),
+    (6, 7),
+])
+def test_rejects_bad_row_field(index, value):
+    row = list(ROW)
+    row[index] = value
+    with pytest.raises(ValueError):
+        ingester.parse_batch(body(rows=[ROW, row]))
+
+
+def test_rejects_wrong_field_count():
+    with pytest.raises(ValueError):
+        ingester.parse_batch(body(rows=[ROW[:-1]]))
+    with pytest.raises(ValueError):
+        ingester.parse_batch(body(pings=[PING + ["extra"]]))
+
+
+def test_rejects_bad_ping():
+    with pytest.raises(ValueError):
+        ingester.parse_batch(body(pings=[[PING[0], "8.8.8.8", "UP", "18"]]))
@@ -0,0 +1,95 @@
+"""從 baseline 的 log.db（文字時間的 system_log）加上 Week 7 的 logs 表，一路升到最新版"""
+import sqlite3
+import time
+
+import schema
+
+# baseline main.py 建的表：timestamp 是本地時間的文字
+BASELINE_SYSTEM_LOG = """
+    CREATE TABLE system_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        cpu REAL,
+        memory REAL,
+        disk REAL,
+        ping_status TEXT,
+        ping_ms REAL
+    )
+"""
+# Week 7 的舊表：欄位名稱大小寫不同
+LEGACY_LOGS = """
+    CREATE TABLE logs (
+        Timestamp TEXT,
+        CPU REAL,
+        Memory REAL,
+        Disk REAL,
+        Ping_Status TEXT,
+        Ping_ms REAL
+    )
+"""
+
+SYSTEM_ROWS = [
+    ("2026-10-01 10:00:00", 10.0, 40.0, 50.0, "UP", 12.0),
+    ("2026-10-01 10:00:30", 20.0, 41.0, 50.0, "DOWN", -1.0),
+    ("2026-10-01 10:01:10", 30.0, 42.0, 50.0, "UP", 14.0),
+]
+LEGACY_ROWS = [
+    ("2026-09-30 09:00:00", 70.0, 60.0, 55.0, "UP", 20.0),
+    ("2026-09-30 09:00:20", 80.0, 61.0, 55.0, "UP", 22.0),
+    ("2026-10-01 10:00:00", 99.0, 99.0, 99.0, "UP", 99.0),  # system_log 已經有這個時間點
+]
+
+
+def local_ms(text):
+    return int(time.mktime(time.strptime(text, schema.TS_FORMAT))) * 1000
+
+
+def baseline_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute(BASELINE_SYSTEM_LOG)
+    conn.execute(LEGACY_LOGS)
+    conn.executemany(
+        "INSERT INTO system_log (timestamp, cpu, memory, disk, ping_status, ping_ms) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        SYSTEM_ROWS,
+    )
+    conn.executemany("INSERT INTO logs VALUES (?, ?, ?, ?, ?, ?)", LEGACY_ROWS)
+    conn.commit()
+    return conn
+
+
+def test_migrate_baseline_and_legacy_logs(tmp_path):
+    conn = baseline_db(tmp_path / "log.db")
+    schema.migrate(conn)
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == schema.SCHEMA_VERSION
+    assert conn.execute("SELECT type FROM pragma_table_info('system_log') WHERE name = 'timestamp'"
+                        ).fetchone()[0] == "INTEGER"
+
+    rows = conn.execute(f"SELECT id, {schema.SELECT_COLUMNS} FROM system_log ORDER BY id").fetchall()
+    # 原本的 id 不變；舊 logs 表的資料接在後面，重複的時間點不搬
+    assert [row[0] for row in rows[:3]] == [1, 2, 3]
+    assert len(rows) == 5
+    assert [row[1] for row in rows[:3]] == [local_ms(r[0]) for r in SYSTEM_ROWS]
+    assert [row[1] for row in rows[3:]] == [local_ms(r[0]) for r in LEGACY_ROWS[:2]]
+    assert rows[3][2:7] == (70.0, 60.0, 55.0, "UP", 20.0)
+    assert all(row[7] is None for row in rows)  # host：v4 以前的資料沒有
+
+    # 舊表的資料 id 比較大但時間比較早：依時間查詢時要排在前面
+    sql, params = schema.window_query()
+    ordered = [row[0] for row in conn.execute(sql, params)]
+    assert ordered == sorted(local_ms(r[0]) for r in LEGACY_ROWS[:2] + SYSTEM_ROWS)
+
+    # 彙總表從搬好的原始資料重算
+    minute = {row[0]: row for row in conn.execute(
+        "SELECT bucket, samples, cpu_avg, up_count, down_count FROM system_log_1m")}
+    first = schema.bucket_start(local_ms(SYSTEM_ROWS[0][0]), 60)
+    assert minute[first][1:] == (2, 15.0, 1, 1)
+    for table in schema.ROLLUPS:
+        total = conn.execute(f"SELECT SUM(samples) FROM {table}").fetchone()[0]
+        assert total == 5, table
+
+    # 再跑一次不會重複搬資料
+    schema.migrate(conn)
+    assert conn.execute("SELECT COUNT(*) FROM system_log").fetchone()[0] == 5
+    conn.close()
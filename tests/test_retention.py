@@ -0,0 +1,81 @@
+"""retention 只刪已經封存成 Parquet 的原始資料：沒裝 pyarrow 或還沒有快照時 system_log 一筆都不刪"""
+import sqlite3
+
+import compact
+import retention
+import schema
+import shards
+
+NOW = 10 * schema.DAY_MS
+HOUR_MS = 3600 * 1000
+RULES = {schema.TABLE: 48 * retention.HOUR, schema.PING_TABLE: 48 * retention.HOUR}
+
+
+def sample(ts):
+    return (ts, 10.0, 40.0, 50.0, "UP", 12.0, "web-1")
+
+
+def log_db(path):
+    conn = sqlite3.connect(path)
+    schema.migrate(conn)
+    # 三天前、兩天半前（都過期）與一小時前（還在保留期限內）
+    times = [NOW - 72 * HOUR_MS, NOW - 60 * HOUR_MS, NOW - HOUR_MS]
+    with conn:
+        schema.insert_samples(conn, [sample(ts) for ts in times],
+                              pings=[(ts, "8.8.8.8", "UP", 12.0) for ts in times], rollups=False)
+    return conn
+
+
+def count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_without_pyarrow_keeps_raw_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(compact, "available", lambda: False)
+    monkeypatch.setattr(shards, "SHARD_DIR", None)
+    conn = log_db(tmp_path / "log.db")
+
+    assert retention.raw_cutoff(NOW) is None
+    report = retention.apply(conn, rules=RULES, now=NOW, pause=0)
+
+    assert count(conn, schema.TABLE) == 3
+    assert count(conn, schema.PING_TABLE) == 1  # 其他表照常刪
+    assert schema.TABLE not in report["reclaimed"]
+    assert report["unarchived"]
+    assert "not yet archived" in retention.describe(report)
+    conn.close()
+
+
+def test_without_snapshot_keeps_raw_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(compact, "available", lambda: True)
+    monkeypatch.setattr(compact, "compact", lambda conn: {})
+    monkeypatch.setattr(compact, "history_boundary", lambda: None)
+    monkeypatch.setattr(shards, "SHARD_DIR", None)
+    conn = log_db(tmp_path / "log.db")
+
+    assert retention.raw_cutoff(NOW) is None
+    report = retention.apply(conn, rules=RULES, now=NOW, pause=0)
+
+    assert count(conn, schema.TABLE) == 3
+    assert report["unarchived"]
+    conn.close()
+
+
+def test_purges_only_up_to_snapshot(tmp_path, monkeypatch):
+    # 快照只涵蓋到三天前那一筆之後：兩天半前那筆雖然過期，還沒封存就不刪
+    boundary = NOW - 66 * HOUR_MS
+    monkeypatch.setattr(compact, "available", lambda: True)
+    monkeypatch.setattr(compact, "compact", lambda conn: {})
+    monkeypatch.setattr(compact, "history_boundary", lambda: boundary)
+    monkeypatch.setattr(shards, "SHARD_DIR", None)
+    conn = log_db(tmp_path / "log.db")
+
+    cutoff = NOW - 48 * HOUR_MS
+    assert retention.raw_cutoff(cutoff) == boundary
+    assert retention.raw_cutoff(boundary - 1) == boundary - 1
+    report = retention.apply(conn, rules=RULES, now=NOW, pause=0)
+
+    assert report["reclaimed"][schema.TABLE] == 1
+    assert count(conn, schema.TABLE) == 2
+    assert report["unarchived"]
+    conn.close()